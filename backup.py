@@ -0,0 +1,118 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+from config import DATABASE_PATH, BACKUP_DIR, BACKUP_INTERVAL_SECONDS, BACKUP_KEEP
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = 'titsbot-'
+SNAPSHOT_SUFFIX = '.db'
+
+
+class BackupAborted(Exception):
+    """Снапшот прерван из-за остановки бота"""
+
+
+class DatabaseBackup:
+    """
+    Онлайн-бэкап SQLite без остановки бота.
+    База копируется через backup API за один шаг. В режиме WAL копирование держит
+    только снимок для чтения, поэтому писатель не блокируется. Копирование порциями
+    здесь не подходит: любая запись другим соединением перезапускает его с начала,
+    и при постоянной записи оно никогда не заканчивается.
+    """
+
+    def __init__(self, db_path: str = DATABASE_PATH, backup_dir: str = BACKUP_DIR,
+                 interval_seconds: int = BACKUP_INTERVAL_SECONDS, keep: int = BACKUP_KEEP):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval_seconds = interval_seconds
+        self.keep = keep
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Не даём двум снапшотам (по расписанию и по команде) идти одновременно
+        self._lock = threading.Lock()
+
+    def create_snapshot(self) -> str:
+        """Создает снапшот базы и возвращает путь к нему"""
+        with self._lock:
+            if self._stop_event.is_set():
+                raise BackupAborted()
+            os.makedirs(self.backup_dir, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+            final_path = os.path.join(self.backup_dir, f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}")
+            # Пишем во временный файл, чтобы в каталоге не оказалось недописанного снапшота
+            tmp_path = final_path + '.part'
+            started = time.monotonic()
+
+            source = sqlite3.connect(self.db_path)
+            try:
+                dest = sqlite3.connect(tmp_path)
+                try:
+                    source.backup(dest, pages=-1)
+                finally:
+                    dest.close()
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            finally:
+                source.close()
+
+            os.replace(tmp_path, final_path)
+            logger.info(f"Снапшот базы создан: {final_path} за {time.monotonic() - started:.2f} с")
+            self.rotate()
+            return final_path
+
+    def list_snapshots(self) -> List[str]:
+        """Возвращает снапшоты от старых к новым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.backup_dir)
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+        )
+        return [os.path.join(self.backup_dir, name) for name in names]
+
+    def rotate(self):
+        """Удаляет старые снапшоты, оставляя последние self.keep"""
+        snapshots = self.list_snapshots()
+        if self.keep <= 0 or len(snapshots) <= self.keep:
+            return
+        for path in snapshots[:-self.keep]:
+            try:
+                os.remove(path)
+                logger.info(f"Удален старый снапшот: {path}")
+            except OSError as e:
+                logger.warning(f"Не удалось удалить снапшот {path}: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.create_snapshot()
+            except BackupAborted:
+                logger.info("Снапшот прерван остановкой бота")
+            except Exception:
+                logger.exception("Ошибка при создании снапшота базы")
+
+    def start(self):
+        """Запускает фоновый поток со снапшотами по расписанию"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='db-backup', daemon=True)
+        self._thread.start()
+        logger.info(f"Резервное копирование включено: каждые {self.interval_seconds} с в {self.backup_dir}")
+
+    def stop(self, timeout: float = 10.0):
+        """Останавливает фоновый поток (начатый снапшот дописывается)"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
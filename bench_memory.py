@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Замер памяти на одного игрока для разных представлений записей.
+
+Строит N синтетических игроков в каждом представлении и меряет прирост памяти
+через tracemalloc: словари (как раньше возвращал Database), UserRecord со __slots__
+и колоночное UserColumns (как в снимке рейтинга). База не нужна.
+
+Пример:
+    python bench_memory.py --users 1000000
+"""
+
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from typing import Callable, List, Optional
+from records import UserColumns, UserRecord
+
+NOW = 1_700_000_000
+
+
+def _names(count: int) -> List[str]:
+    # Имена создаются заранее и общие для всех представлений: меряем только сами записи
+    return [f"user{i}" for i in range(count)]
+
+
+def build_dicts(count: int, names: List[str]):
+    return [
+        {
+            'user_id': 100_000 + i,
+            'username': names[i],
+            'first_name': names[i],
+            'last_name': None,
+            'breast_size': random.randint(-50, 50),
+            'created_at': NOW,
+            'updated_at': NOW + i
+        }
+        for i in range(count)
+    ]
+
+
+def build_records(count: int, names: List[str]):
+    return [
+        UserRecord(100_000 + i, names[i], names[i], None, random.randint(-50, 50), NOW, NOW + i)
+        for i in range(count)
+    ]
+
+
+def build_columns(count: int, names: List[str]):
+    columns = UserColumns()
+    for i in range(count):
+        columns.append(100_000 + i, random.randint(-50, 50), NOW + i)
+    return columns
+
+
+def measure(build: Callable, count: int, names: List[str]) -> tuple:
+    """Возвращает (байт на игрока, секунд на построение)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(count, names)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / count, elapsed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замер памяти на одного игрока")
+    parser.add_argument('--users', type=int, default=1_000_000, help="количество игроков")
+    args = parser.parse_args(argv)
+
+    random.seed(1)
+    names = _names(args.users)
+    print(f"Игроков: {args.users}")
+    print(f"{'Представление':<26}{'Байт/игрок':>12}{'Всего, МБ':>12}{'Построение, с':>16}")
+    for title, build in (
+        ("dict (7 полей)", build_dicts),
+        ("UserRecord (__slots__)", build_records),
+        ("UserColumns (array 'q')", build_columns),
+    ):
+        per_user, elapsed = measure(build, args.users, names)
+        total_mb = per_user * args.users / (1024 * 1024)
+        print(f"{title:<26}{per_user:>12.1f}{total_mb:>12.1f}{elapsed:>16.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
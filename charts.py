@@ -0,0 +1,179 @@
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from config import CHART_CACHE_SIZE, CHART_MAX_POINTS
+
+# Размер картинки и цвета (RGB)
+CHART_WIDTH = 640
+CHART_HEIGHT = 320
+_PADDING = 16
+_BACKGROUND = (255, 255, 255)
+_FRAME = (200, 200, 200)
+_ZERO_LINE = (150, 150, 150)
+_LINE = (220, 50, 110)
+
+Point = Tuple[float, float]
+
+
+def lttb(points: Sequence[Point], threshold: int) -> List[Point]:
+    """
+    Прореживание Largest-Triangle-Three-Buckets: оставляет threshold точек,
+    сохраняя форму графика (пики и провалы не теряются).
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Среднее следующей корзины — третья вершина треугольника
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        next_len = next_end - next_start
+        avg_x = sum(points[j][0] for j in range(next_start, next_end)) / next_len
+        avg_y = sum(points[j][1] for j in range(next_start, next_end)) / next_len
+
+        # В текущей корзине берем точку с наибольшей площадью треугольника
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+class _Canvas:
+    """Простейший RGB-холст, который умеет рисовать линии и сохраняться в PNG"""
+
+    def __init__(self, width: int, height: int, background: Tuple[int, int, int]):
+        self.width = width
+        self.height = height
+        # Каждая строка PNG начинается с байта фильтра (0 = без фильтра)
+        self.stride = 1 + width * 3
+        self.pixels = bytearray((b'\x00' + bytes(background) * width) * height)
+
+    def set_pixel(self, x: int, y: int, color: Tuple[int, int, int]):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            offset = y * self.stride + 1 + x * 3
+            self.pixels[offset:offset + 3] = bytes(color)
+
+    def hline(self, x0: int, x1: int, y: int, color: Tuple[int, int, int]):
+        for x in range(x0, x1 + 1):
+            self.set_pixel(x, y, color)
+
+    def vline(self, x: int, y0: int, y1: int, color: Tuple[int, int, int]):
+        for y in range(y0, y1 + 1):
+            self.set_pixel(x, y, color)
+
+    def line(self, x0: int, y0: int, x1: int, y1: int, color: Tuple[int, int, int]):
+        """Линия толщиной 2 пикселя (алгоритм Брезенхэма)"""
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            self.set_pixel(x0, y0, color)
+            self.set_pixel(x0, y0 + 1, color)
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def to_png(self) -> bytes:
+        header = struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)
+        return (
+            b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(bytes(self.pixels), 6))
+            + _png_chunk(b'IEND', b'')
+        )
+
+
+def render_size_chart(points: Sequence[Point], max_points: int = CHART_MAX_POINTS,
+                      width: int = CHART_WIDTH, height: int = CHART_HEIGHT) -> bytes:
+    """Рисует график размера во времени: points — (время, размер) по возрастанию времени"""
+    points = lttb(points, max_points)
+    canvas = _Canvas(width, height, _BACKGROUND)
+    left, top = _PADDING, _PADDING
+    right, bottom = width - _PADDING - 1, height - _PADDING - 1
+
+    canvas.hline(left, right, top, _FRAME)
+    canvas.hline(left, right, bottom, _FRAME)
+    canvas.vline(left, top, bottom, _FRAME)
+    canvas.vline(right, top, bottom, _FRAME)
+    if not points:
+        return canvas.to_png()
+
+    min_x, max_x = points[0][0], points[-1][0]
+    min_y = min(y for _, y in points)
+    max_y = max(y for _, y in points)
+    span_x = (max_x - min_x) or 1
+    span_y = (max_y - min_y) or 1
+
+    def to_canvas(point: Point) -> Tuple[int, int]:
+        x = left + 1 + round((point[0] - min_x) * (right - left - 2) / span_x)
+        y = bottom - 2 - round((point[1] - min_y) * (bottom - top - 3) / span_y)
+        return x, y
+
+    # Линия нуля, если график ее пересекает
+    if min_y < 0 < max_y:
+        canvas.hline(left + 1, right - 1, to_canvas((min_x, 0))[1], _ZERO_LINE)
+
+    previous = to_canvas(points[0])
+    for point in points[1:]:
+        current = to_canvas(point)
+        canvas.line(previous[0], previous[1], current[0], current[1], _LINE)
+        previous = current
+    if len(points) == 1:
+        canvas.line(left + 1, previous[1], right - 1, previous[1], _LINE)
+    return canvas.to_png()
+
+
+class SizeChartCache:
+    """
+    Кэш готовых графиков: по одному на пользователя, действителен, пока
+    id последней записи истории не изменился (то есть до следующего /tits).
+    """
+
+    def __init__(self, max_entries: int = CHART_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[int, Tuple[int, bytes, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, last_history_id: int) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != last_history_id:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1], entry[2]
+
+    def put(self, user_id: int, last_history_id: int, png: bytes, caption: str):
+        with self._lock:
+            self._entries[user_id] = (last_history_id, png, caption)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
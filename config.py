@@ -7,11 +7,26 @@ load_dotenv()
 
 # Конфигурация бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')  # Читаем токен из переменных окружения / .env
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден. Укажите его в .env или в переменных окружения")
+
+def require_bot_token() -> str:
+    """Проверяет наличие токена. Вызывается при запуске бота, а не при импорте,
+    чтобы тесты и утилиты могли импортировать конфиг без токена."""
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не найден. Укажите его в .env или в переменных окружения")
+    return BOT_TOKEN
+
+# Адрес Bot API. Для нагрузочного теста указывается локальный сервер (см. fake_telegram.py),
+# например http://127.0.0.1:8081/bot — токен дописывается в конец
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
 
 # Настройки базы данных
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'titsbot.db')
+# Сколько read-only соединений держать в пуле для запросов на чтение
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+# Сколько обновлений обрабатывать одновременно (обращения к базе не блокируют цикл событий)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+# Сколько дней хранить дневные итоги по пользователям в чатах (для лидеров дня)
+ANALYTICS_RETENTION_DAYS = int(os.getenv('ANALYTICS_RETENTION_DAYS', '31'))
 
 # Настройки игры
 MIN_SIZE = -1000000  # Минимальный размер груди
@@ -60,3 +75,57 @@ ADMIN_USER_IDS: Set[int] = _parse_admin_ids(os.getenv('ADMIN_USER_IDS', '1855337
 # Прямая настройка (на случай отсутствия переменных окружения):
 # ADMIN_USER_IDS: Set[int] = {123456789}
 
+
+# Резервное копирование базы данных (онлайн-снапшоты через SQLite backup API)
+# BACKUP_ENABLED: включить периодические снапшоты
+# BACKUP_DIR: каталог для снапшотов
+# BACKUP_INTERVAL_SECONDS: интервал между снапшотами (по умолчанию 6 часов)
+# BACKUP_KEEP: сколько последних снапшотов хранить
+BACKUP_ENABLED = os.getenv('BACKUP_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL_SECONDS = int(os.getenv('BACKUP_INTERVAL_SECONDS', str(6 * 60 * 60)))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+
+# Плавная остановка: сколько секунд ждать завершения начатых обработчиков после SIGTERM
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '25'))
+
+# Анти-спам для всех команд (в памяти, до обращения к базе)
+# THROTTLE_USER_LIMIT/THROTTLE_USER_WINDOW: не больше N команд от пользователя за окно в секундах
+# THROTTLE_CHAT_LIMIT/THROTTLE_CHAT_WINDOW: то же для чата
+# THROTTLE_DUPLICATE_WINDOW: одинаковые команды подряд в течение этого времени схлопываются
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+THROTTLE_USER_LIMIT = int(os.getenv('THROTTLE_USER_LIMIT', '5'))
+THROTTLE_USER_WINDOW = float(os.getenv('THROTTLE_USER_WINDOW', '10'))
+THROTTLE_CHAT_LIMIT = int(os.getenv('THROTTLE_CHAT_LIMIT', '30'))
+THROTTLE_CHAT_WINDOW = float(os.getenv('THROTTLE_CHAT_WINDOW', '10'))
+THROTTLE_DUPLICATE_WINDOW = float(os.getenv('THROTTLE_DUPLICATE_WINDOW', '3'))
+
+# Ежедневная сводка в групповые чаты (через job queue, нужен python-telegram-bot[job-queue])
+# DIGEST_TIME: время отправки по UTC в формате HH:MM
+# DIGEST_TOP_N: сколько лидеров дня показывать
+# DIGEST_CONCURRENCY / DIGEST_RATE_PER_SECOND: ограничения рассылки, чтобы не упираться
+# в лимиты Telegram (~30 сообщений/с) и не мешать обычным командам
+DIGEST_ENABLED = os.getenv('DIGEST_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+try:
+    DIGEST_HOUR, DIGEST_MINUTE = (int(part) for part in os.getenv('DIGEST_TIME', '21:00').split(':'))
+except ValueError:
+    DIGEST_HOUR, DIGEST_MINUTE = 21, 0
+DIGEST_TOP_N = int(os.getenv('DIGEST_TOP_N', '3'))
+DIGEST_CONCURRENCY = int(os.getenv('DIGEST_CONCURRENCY', '8'))
+DIGEST_RATE_PER_SECOND = float(os.getenv('DIGEST_RATE_PER_SECOND', '20'))
+
+# Графики для /history chart
+# CHART_MAX_POINTS: до скольких точек прореживать длинную историю
+# CHART_CACHE_SIZE: сколько готовых графиков держать в памяти
+CHART_MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', '300'))
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '1000'))
+
+# Inline-режим (@bot top, @bot me) отвечает из снимка рейтинга в памяти
+# LEADERBOARD_REFRESH_SECONDS: как часто пересобирать снимок (и сколько Telegram кэширует ответ)
+# LEADERBOARD_TOP_N: сколько игроков в топе
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', '60'))
+LEADERBOARD_TOP_N = int(os.getenv('LEADERBOARD_TOP_N', '10'))
+
+# Обработка обновлений ровно один раз: сколько последних update_id помнить
+# (в памяти и в кольцевой таблице processed_updates)
+PROCESSED_UPDATES_RING = int(os.getenv('PROCESSED_UPDATES_RING', '10000'))
@@ -1,24 +1,175 @@
+import time
+import queue
 import sqlite3
 import logging
-from typing import Optional, List, Tuple
-from config import DATABASE_PATH
+import pathlib
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, List, Tuple
+from config import DATABASE_PATH, DB_READ_POOL_SIZE, ANALYTICS_RETENTION_DAYS, PROCESSED_UPDATES_RING
+from game_logic import GameLogic, SIZE_BUCKETS
+from records import HistoryRecord, UserColumns, UserRecord
 
 logger = logging.getLogger(__name__)
 
+# Версия схемы хранится в PRAGMA user_version. Если она актуальна,
+# DDL при запуске не выполняется
+# 2: время хранится целыми секундами Unix (UTC) вместо текста CURRENT_TIMESTAMP
+# 3: агрегаты для /globalstats, обновляемые при каждом изменении
+# 4: журнал обработанных update_id и неотправленные ответы (обработка ровно один раз)
+SCHEMA_VERSION = 4
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Таблицы агрегатов: пересчитываются из users/size_history при миграции и импорте
+_ANALYTICS_TABLES = ('stats_daily', 'stats_size_buckets', 'stats_chat_daily', 'stats_chat_user_daily')
+
+# Значение по умолчанию для колонок времени: секунды Unix (UTC)
+_NOW_EPOCH = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Колонки времени, которые в старых базах хранились текстом
+_TIMESTAMP_COLUMNS = (
+    ('users', 'created_at'),
+    ('users', 'updated_at'),
+    ('chats', 'created_at'),
+    ('size_history', 'created_at'),
+)
+
+def _now() -> int:
+    return int(time.time())
+
+def _day(timestamp: int) -> int:
+    """Номер суток (UTC) для секунд Unix"""
+    return timestamp // SECONDS_PER_DAY
+
+
+class _Writer(threading.Thread):
+    """
+    Единственный поток, который пишет в базу. Все изменения выполняются
+    по очереди на одном соединении, поэтому писатели не конкурируют
+    за блокировку SQLite между собой.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path: str):
+        super().__init__(name='db-writer', daemon=True)
+        self.db_path = db_path
+        self.queue: 'queue.Queue' = queue.Queue()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self._STOP:
+                    break
+                operation, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    # Каждая операция — отдельная транзакция
+                    with conn:
+                        result = operation(conn)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            conn.close()
+
+    def stop(self):
+        """Дописывает все поставленные в очередь изменения и останавливает поток"""
+        self.queue.put(self._STOP)
+
+
 class Database:
-    def __init__(self, db_path: str = DATABASE_PATH):
+    def __init__(self, db_path: str = DATABASE_PATH, read_pool_size: int = DB_READ_POOL_SIZE):
         self.db_path = db_path
         self.init_database()
+        # Чтение — из пула read-only соединений, запись — через единственный поток-писатель.
+        # В режиме WAL читатели не ждут писателя и наоборот
+        self._read_pool: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue(maxsize=read_pool_size)
+        self._writer = _Writer(db_path)
+        self._writer.start()
+        self._closed = False
+        # Сутки, за которые уже удалялись устаревшие агрегаты (меняется только в потоке-писателе)
+        self._analytics_pruned_day: Optional[int] = None
     
     def get_connection(self):
         """Создает соединение с базой данных"""
         return sqlite3.connect(self.db_path)
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = pathlib.Path(self.db_path).absolute().as_uri() + '?mode=ro'
+        # Соединение переходит между потоками только через пул, одновременно им пользуется один поток
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def read_connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдает read-only соединение из пула"""
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_reader()
+        try:
+            yield conn
+        finally:
+            try:
+                self._read_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def submit_write(self, operation: Callable[[sqlite3.Connection], object]) -> Future:
+        """Ставит изменение в очередь писателя, не дожидаясь выполнения"""
+        if self._closed:
+            raise RuntimeError("База данных закрыта")
+        future: Future = Future()
+        self._writer.queue.put((operation, future))
+        return future
+
+    def _write(self, operation: Callable[[sqlite3.Connection], object], wait: bool = True):
+        """
+        Выполняет изменение в потоке-писателе и возвращает результат.
+        С wait=False сразу возвращает Future — обработчики ждут его через
+        asyncio.wrap_future, не блокируя цикл событий
+        """
+        future = self.submit_write(operation)
+        return future.result() if wait else future
+
+    def close(self, timeout: Optional[float] = None):
+        """Дописывает очередь изменений и закрывает все соединения"""
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.stop()
+        self._writer.join(timeout)
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+        logger.info("Соединения с базой данных закрыты")
     
     def init_database(self):
         """Инициализирует базу данных и создает необходимые таблицы"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            # WAL позволяет читать параллельно с записью (режим сохраняется в файле базы)
+            cursor.execute('PRAGMA journal_mode = WAL')
+            
+            # Быстрый путь: схема уже создана этой версией бота
+            cursor.execute('PRAGMA user_version')
+            version = cursor.fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                logger.info("Схема базы данных актуальна")
+                return
+            
             # Создаем таблицу пользователей
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -27,10 +178,10 @@ class Database:
                     first_name TEXT,
                     last_name TEXT,
                     breast_size INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at INTEGER DEFAULT {now},
+                    updated_at INTEGER DEFAULT {now}
                 )
-            ''')
+            '''.format(now=_NOW_EPOCH))
             
             # Создаем таблицу чатов
             cursor.execute('''
@@ -38,9 +189,9 @@ class Database:
                     chat_id INTEGER PRIMARY KEY,
                     chat_type TEXT,
                     title TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at INTEGER DEFAULT {now}
                 )
-            ''')
+            '''.format(now=_NOW_EPOCH))
             
             # Создаем таблицу истории изменений
             cursor.execute('''
@@ -51,30 +202,199 @@ class Database:
                     old_size INTEGER,
                     new_size INTEGER,
                     change_amount INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_at INTEGER DEFAULT {now},
                     FOREIGN KEY (user_id) REFERENCES users (user_id),
                     FOREIGN KEY (chat_id) REFERENCES chats (chat_id)
                 )
+            '''.format(now=_NOW_EPOCH))
+            
+            # Миграция 1 → 2: текстовое время → секунды Unix.
+            # Колонки старых баз объявлены как TIMESTAMP (NUMERIC), целые в них хранятся
+            # без перестройки таблиц; время во всех INSERT/UPDATE передается явно
+            if version < 2:
+                self._convert_text_timestamps(cursor)
+            
+            # Индекс для кулдауна и истории пользователя (сортировка по времени)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_size_history_user_time
+                ON size_history (user_id, created_at)
             ''')
             
+            # Агрегаты для /globalstats. day — номер суток UTC (секунды Unix // 86400),
+            # bucket — номер группы из GameLogic.get_size_bucket
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day INTEGER PRIMARY KEY,
+                    rolls INTEGER NOT NULL DEFAULT 0,
+                    new_players INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_size_buckets (
+                    bucket INTEGER PRIMARY KEY,
+                    users INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_chat_daily (
+                    chat_id INTEGER,
+                    day INTEGER,
+                    rolls INTEGER NOT NULL DEFAULT 0,
+                    total_change INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (chat_id, day)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS stats_chat_user_daily (
+                    chat_id INTEGER,
+                    day INTEGER,
+                    user_id INTEGER,
+                    rolls INTEGER NOT NULL DEFAULT 0,
+                    gain INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (chat_id, day, user_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_stats_chat_user_daily_gain
+                ON stats_chat_user_daily (chat_id, day, gain)
+            ''')
+            
+            # Миграция 2 → 3: заполняем агрегаты по уже накопленным данным (один раз)
+            if version < 3:
+                self._rebuild_analytics(cursor)
+            
+            # Кольцевой журнал обработанных обновлений Telegram: slot = update_id % размер кольца,
+            # поэтому таблица не растет. Ответы, записанные вместе с изменением, но еще
+            # не отправленные, лежат в pending_replies и переотправляются при запуске
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS processed_updates (
+                    slot INTEGER PRIMARY KEY,
+                    update_id INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pending_replies (
+                    update_id INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER,
+                    text TEXT NOT NULL,
+                    created_at INTEGER
+                )
+            ''')
+            
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
             conn.commit()
             logger.info("База данных инициализирована")
 
-    def reset_all_stats(self):
+    @staticmethod
+    def _convert_text_timestamps(cursor):
+        """Переводит текстовые 'YYYY-MM-DD HH:MM:SS' (UTC) в секунды Unix"""
+        for table, column in _TIMESTAMP_COLUMNS:
+            cursor.execute(f'''
+                UPDATE {table}
+                SET {column} = CAST(strftime('%s', {column}) AS INTEGER)
+                WHERE typeof({column}) = 'text'
+            ''')
+            if cursor.rowcount > 0:
+                logger.info(f"{table}.{column}: переведено в секунды Unix {cursor.rowcount} строк")
+
+    def convert_text_timestamps(self):
+        """Переводит текстовое время в секунды Unix (например, после импорта старого дампа)"""
+        self._write(lambda conn: self._convert_text_timestamps(conn.cursor()))
+
+    @staticmethod
+    def _rebuild_analytics(cursor):
+        """Пересчитывает агрегаты по users и size_history целиком"""
+        for table in _ANALYTICS_TABLES:
+            cursor.execute(f'DELETE FROM {table}')
+        
+        # Гистограмма: размеров немного, группируем в SQL, раскладываем по группам в Python
+        buckets = [0] * len(SIZE_BUCKETS)
+        cursor.execute('SELECT breast_size, COUNT(*) FROM users GROUP BY breast_size')
+        for size, count in cursor.fetchall():
+            buckets[GameLogic.get_size_bucket(size or 0)] += count
+        cursor.executemany(
+            'INSERT INTO stats_size_buckets (bucket, users) VALUES (?, ?)',
+            [(bucket, count) for bucket, count in enumerate(buckets) if count]
+        )
+        
+        cursor.execute(f'''
+            INSERT INTO stats_daily (day, rolls)
+            SELECT created_at / {SECONDS_PER_DAY}, COUNT(*)
+            FROM size_history WHERE created_at IS NOT NULL
+            GROUP BY 1
+        ''')
+        cursor.execute(f'''
+            INSERT INTO stats_daily (day, new_players)
+            SELECT created_at / {SECONDS_PER_DAY}, COUNT(*)
+            FROM users WHERE created_at IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET new_players = excluded.new_players
+        ''')
+        cursor.execute(f'''
+            INSERT INTO stats_chat_daily (chat_id, day, rolls, total_change)
+            SELECT chat_id, created_at / {SECONDS_PER_DAY}, COUNT(*), SUM(change_amount)
+            FROM size_history WHERE created_at IS NOT NULL
+            GROUP BY 1, 2
+        ''')
+        cursor.execute(f'''
+            INSERT INTO stats_chat_user_daily (chat_id, day, user_id, rolls, gain)
+            SELECT chat_id, created_at / {SECONDS_PER_DAY}, user_id, COUNT(*), SUM(change_amount)
+            FROM size_history
+            WHERE created_at >= ?
+            GROUP BY 1, 2, 3
+        ''', ((_day(_now()) - ANALYTICS_RETENTION_DAYS + 1) * SECONDS_PER_DAY,))
+        logger.info("Агрегаты статистики пересчитаны")
+
+    def rebuild_analytics(self):
+        """Пересчитывает агрегаты (например, после импорта данных)"""
+        self._write(lambda conn: self._rebuild_analytics(conn.cursor()))
+
+    @staticmethod
+    def _bump_size_bucket(cursor, size: int, delta: int):
+        cursor.execute('''
+            INSERT INTO stats_size_buckets (bucket, users) VALUES (?, ?)
+            ON CONFLICT (bucket) DO UPDATE SET users = users + excluded.users
+        ''', (GameLogic.get_size_bucket(size), delta))
+
+    def _prune_analytics(self, cursor, today: int):
+        """Раз в сутки удаляет дневные итоги пользователей старше срока хранения"""
+        if self._analytics_pruned_day == today:
+            return
+        cursor.execute(
+            'DELETE FROM stats_chat_user_daily WHERE day <= ?',
+            (today - ANALYTICS_RETENTION_DAYS,)
+        )
+        self._analytics_pruned_day = today
+
+    def warm_up(self):
+        """
+        Прогревает кэш страниц соединения-читателя самыми частыми запросами (вызывается в фоне).
+        Полные проходы по таблицам не делаем: на большой истории они только мешают разбору очереди
+        """
+        top_users = self.get_top_users(10)
+        # Проверка кулдауна — спуск по индексу истории, как на каждом /tits
+        if top_users:
+            self.get_last_tits_usage(top_users[0].user_id)
+
+    def reset_all_stats(self, wait: bool = True):
         """Полный сброс: очистить историю и пользователей, чтобы топ стал пустым."""
-        with self.get_connection() as conn:
+        def _op(conn):
             cursor = conn.cursor()
             # Сначала чистим историю изменений
             cursor.execute('DELETE FROM size_history')
             # Затем удаляем всех пользователей (топ станет пустым)
             cursor.execute('DELETE FROM users')
+            # Агрегаты считаются по истории и пользователям — очищаем и их
+            for table in _ANALYTICS_TABLES:
+                cursor.execute(f'DELETE FROM {table}')
             # По желанию можно также очистить чаты. Оставим чаты, чтобы названия сохранялись.
-            conn.commit()
+        return self._write(_op, wait)
     
     def get_or_create_user(self, user_id: int, username: str = None, 
-                          first_name: str = None, last_name: str = None) -> dict:
+                          first_name: str = None, last_name: str = None, wait: bool = True) -> UserRecord:
         """Получает или создает пользователя"""
-        with self.get_connection() as conn:
+        def _op(conn):
             cursor = conn.cursor()
             
             # Проверяем, существует ли пользователь
@@ -85,43 +405,52 @@ class Database:
             
             user = cursor.fetchone()
             
+            now = _now()
             if user:
                 # Обновляем информацию о пользователе
                 cursor.execute('''
                     UPDATE users 
-                    SET username = ?, first_name = ?, last_name = ?, updated_at = CURRENT_TIMESTAMP
+                    SET username = ?, first_name = ?, last_name = ?, updated_at = ?
                     WHERE user_id = ?
-                ''', (username, first_name, last_name, user_id))
+                ''', (username, first_name, last_name, now, user_id))
                 
-                return {
-                    'user_id': user[0],
-                    'username': username or user[1],
-                    'first_name': first_name or user[2],
-                    'last_name': last_name or user[3],
-                    'breast_size': user[4],
-                    'created_at': user[5],
-                    'updated_at': user[6]
-                }
+                return UserRecord(
+                    user_id=user[0],
+                    username=username or user[1],
+                    first_name=first_name or user[2],
+                    last_name=last_name or user[3],
+                    breast_size=user[4],
+                    created_at=user[5],
+                    updated_at=now
+                )
             else:
                 # Создаем нового пользователя
                 cursor.execute('''
-                    INSERT INTO users (user_id, username, first_name, last_name, breast_size)
-                    VALUES (?, ?, ?, ?, 0)
-                ''', (user_id, username, first_name, last_name))
+                    INSERT INTO users (user_id, username, first_name, last_name, breast_size, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, 0, ?, ?)
+                ''', (user_id, username, first_name, last_name, now, now))
                 
-                return {
-                    'user_id': user_id,
-                    'username': username,
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'breast_size': 0,
-                    'created_at': None,
-                    'updated_at': None
-                }
+                # Агрегаты: новый игрок и его группа размера
+                cursor.execute('''
+                    INSERT INTO stats_daily (day, new_players) VALUES (?, 1)
+                    ON CONFLICT (day) DO UPDATE SET new_players = new_players + 1
+                ''', (_day(now),))
+                self._bump_size_bucket(cursor, 0, 1)
+                
+                return UserRecord(
+                    user_id=user_id,
+                    username=username,
+                    first_name=first_name,
+                    last_name=last_name,
+                    breast_size=0,
+                    created_at=now,
+                    updated_at=now
+                )
+        return self._write(_op, wait)
     
-    def get_or_create_chat(self, chat_id: int, chat_type: str, title: str = None) -> dict:
+    def get_or_create_chat(self, chat_id: int, chat_type: str, title: str = None, wait: bool = True) -> dict:
         """Получает или создает чат"""
-        with self.get_connection() as conn:
+        def _op(conn):
             cursor = conn.cursor()
             
             # Проверяем, существует ли чат
@@ -141,21 +470,28 @@ class Database:
                 }
             else:
                 # Создаем новый чат
+                now = _now()
                 cursor.execute('''
-                    INSERT INTO chats (chat_id, chat_type, title)
-                    VALUES (?, ?, ?)
-                ''', (chat_id, chat_type, title))
+                    INSERT INTO chats (chat_id, chat_type, title, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (chat_id, chat_type, title, now))
                 
                 return {
                     'chat_id': chat_id,
                     'chat_type': chat_type,
                     'title': title,
-                    'created_at': None
+                    'created_at': now
                 }
+        return self._write(_op, wait)
     
-    def update_breast_size(self, user_id: int, new_size: int, change_amount: int, chat_id: int):
-        """Обновляет размер груди пользователя и сохраняет историю"""
-        with self.get_connection() as conn:
+    def update_breast_size(self, user_id: int, new_size: int, change_amount: int, chat_id: int,
+                           pending_reply: Optional[dict] = None, wait: bool = True):
+        """
+        Обновляет размер груди пользователя и сохраняет историю.
+        pending_reply ({'update_id', 'chat_id', 'message_id', 'text'}) записывается в той же
+        транзакции: обновление отмечается обработанным, а ответ переживет падение бота
+        """
+        def _op(conn):
             cursor = conn.cursor()
             
             # Получаем текущий размер
@@ -164,28 +500,102 @@ class Database:
             
             if result:
                 old_size = result[0]
+                now = _now()
                 
                 # Обновляем размер груди
                 cursor.execute('''
                     UPDATE users 
-                    SET breast_size = ?, updated_at = CURRENT_TIMESTAMP
+                    SET breast_size = ?, updated_at = ?
                     WHERE user_id = ?
-                ''', (new_size, user_id))
+                ''', (new_size, now, user_id))
                 
                 # Сохраняем в историю
                 cursor.execute('''
-                    INSERT INTO size_history (user_id, chat_id, old_size, new_size, change_amount)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, chat_id, old_size, new_size, change_amount))
+                    INSERT INTO size_history (user_id, chat_id, old_size, new_size, change_amount, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, chat_id, old_size, new_size, change_amount, now))
+                
+                # Агрегаты обновляются в той же транзакции, что и история
+                today = _day(now)
+                cursor.execute('''
+                    INSERT INTO stats_daily (day, rolls) VALUES (?, 1)
+                    ON CONFLICT (day) DO UPDATE SET rolls = rolls + 1
+                ''', (today,))
+                if GameLogic.get_size_bucket(old_size) != GameLogic.get_size_bucket(new_size):
+                    self._bump_size_bucket(cursor, old_size, -1)
+                    self._bump_size_bucket(cursor, new_size, 1)
+                cursor.execute('''
+                    INSERT INTO stats_chat_daily (chat_id, day, rolls, total_change) VALUES (?, ?, 1, ?)
+                    ON CONFLICT (chat_id, day) DO UPDATE
+                    SET rolls = rolls + 1, total_change = total_change + excluded.total_change
+                ''', (chat_id, today, change_amount))
+                cursor.execute('''
+                    INSERT INTO stats_chat_user_daily (chat_id, day, user_id, rolls, gain) VALUES (?, ?, ?, 1, ?)
+                    ON CONFLICT (chat_id, day, user_id) DO UPDATE
+                    SET rolls = rolls + 1, gain = gain + excluded.gain
+                ''', (chat_id, today, user_id, change_amount))
+                self._prune_analytics(cursor, today)
+                
+                if pending_reply:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO processed_updates (slot, update_id) VALUES (?, ?)
+                    ''', (pending_reply['update_id'] % PROCESSED_UPDATES_RING, pending_reply['update_id']))
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO pending_replies (update_id, chat_id, message_id, text, created_at)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (pending_reply['update_id'], pending_reply['chat_id'],
+                          pending_reply.get('message_id'), pending_reply['text'], now))
                 
-                conn.commit()
                 return True
             else:
                 return False
+        return self._write(_op, wait)
 
-    def get_last_tits_usage(self, user_id: int) -> Optional[str]:
-        """Возвращает время последнего использования /tits пользователем (строка TIMESTAMP)"""
-        with self.get_connection() as conn:
+    def get_processed_update_ids(self) -> List[int]:
+        """Возвращает update_id из журнала обработанных обновлений (по возрастанию)"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT update_id FROM processed_updates ORDER BY update_id')
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_pending_replies(self) -> List[dict]:
+        """Возвращает ответы, которые были записаны, но не подтверждены как отправленные"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT update_id, chat_id, message_id, text
+                FROM pending_replies
+                ORDER BY update_id
+            ''')
+            return [
+                {
+                    'update_id': row[0],
+                    'chat_id': row[1],
+                    'message_id': row[2],
+                    'text': row[3]
+                }
+                for row in cursor.fetchall()
+            ]
+
+    def forget_pending_reply(self, update_id: int) -> Future:
+        """Удаляет отправленный ответ. Не ждет записи — в горячем пути лишнего ожидания нет"""
+        return self.submit_write(
+            lambda conn: conn.execute('DELETE FROM pending_replies WHERE update_id = ?', (update_id,))
+        )
+
+    def get_rank_for_size(self, user_id: int, size: int) -> int:
+        """Место, которое займет пользователь с размером size (до записи нового размера)"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT COUNT(*) FROM users WHERE breast_size > ? AND user_id != ?',
+                (size, user_id)
+            )
+            return cursor.fetchone()[0] + 1
+
+    def get_last_tits_usage(self, user_id: int) -> Optional[int]:
+        """Возвращает время последнего использования /tits пользователем (секунды Unix)"""
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 '''
@@ -202,7 +612,7 @@ class Database:
     
     def get_user_stats(self, user_id: int) -> Optional[dict]:
         """Получает статистику пользователя"""
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -233,34 +643,75 @@ class Database:
                 }
             return None
     
-    def get_top_users(self, limit: int = 10) -> List[dict]:
+    def get_top_users(self, limit: int = 10) -> List[UserRecord]:
         """Получает топ пользователей по размеру груди"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT user_id, username, first_name, last_name, breast_size
-                FROM users
-                ORDER BY breast_size DESC
-                LIMIT ?
-            ''', (limit,))
-            
-            results = cursor.fetchall()
-            
-            return [
-                {
-                    'user_id': row[0],
-                    'username': row[1],
-                    'first_name': row[2],
-                    'last_name': row[3],
-                    'breast_size': row[4]
-                }
-                for row in results
-            ]
+        with self.read_connection() as conn:
+            return self._fetch_top_users(conn.cursor(), limit)
+
+    @staticmethod
+    def _fetch_top_users(cursor: sqlite3.Cursor, limit: int) -> List[UserRecord]:
+        cursor.execute('''
+            SELECT user_id, username, first_name, last_name, breast_size
+            FROM users
+            ORDER BY breast_size DESC
+            LIMIT ?
+        ''', (limit,))
+        
+        return [
+            UserRecord(
+                user_id=row[0],
+                username=row[1],
+                first_name=row[2],
+                last_name=row[3],
+                breast_size=row[4]
+            )
+            for row in cursor.fetchall()
+        ]
+
+    def iter_user_states(self) -> Iterator[Tuple[int, int, Optional[int]]]:
+        """
+        Потоково отдает (user_id, размер, время последнего броска) всех игроков
+        по возрастанию user_id. Последний бросок берется по индексу истории
+        """
+        with self.read_connection() as conn:
+            yield from self._iter_user_states(conn.cursor())
+
+    @staticmethod
+    def _iter_user_states(cursor: sqlite3.Cursor) -> Iterator[Tuple[int, int, Optional[int]]]:
+        cursor.arraysize = 5000
+        cursor.execute('''
+            SELECT u.user_id, u.breast_size,
+                   (SELECT MAX(h.created_at) FROM size_history h WHERE h.user_id = u.user_id)
+            FROM users u
+            ORDER BY u.user_id
+        ''')
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+
+    def get_leaderboard(self, top_n: int) -> Tuple[List[UserRecord], UserColumns]:
+        """
+        Топ-N и колонки состояния всех игроков из одного состояния базы:
+        оба запроса идут в одной транзакции чтения на одном соединении
+        """
+        with self.read_connection() as conn:
+            conn.execute('BEGIN')
+            try:
+                cursor = conn.cursor()
+                top = self._fetch_top_users(cursor, top_n)
+                users = UserColumns()
+                for user_id, size, last_roll in self._iter_user_states(cursor):
+                    users.append(user_id, size, last_roll)
+            finally:
+                # Соединение только читает: завершение транзакции лишь отпускает снимок WAL
+                conn.rollback()
+        return top, users
 
     def get_user_rank(self, user_id: int) -> Optional[int]:
         """Возвращает место пользователя в рейтинге (1 = лучший)."""
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             # Получаем текущий размер
             cursor.execute('SELECT breast_size FROM users WHERE user_id = ?', (user_id,))
@@ -273,9 +724,9 @@ class Database:
             higher = cursor.fetchone()[0]
             return higher + 1
     
-    def get_user_history(self, user_id: int, limit: int = 10) -> List[dict]:
+    def get_user_history(self, user_id: int, limit: int = 10) -> List[HistoryRecord]:
         """Получает историю изменений пользователя"""
-        with self.get_connection() as conn:
+        with self.read_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -284,19 +735,128 @@ class Database:
                 FROM size_history h
                 LEFT JOIN chats c ON h.chat_id = c.chat_id
                 WHERE h.user_id = ?
-                ORDER BY h.created_at DESC
+                ORDER BY h.created_at DESC, h.id DESC
                 LIMIT ?
             ''', (user_id, limit))
             
             results = cursor.fetchall()
             
-            return [
-                {
-                    'old_size': row[0],
-                    'new_size': row[1],
-                    'change_amount': row[2],
-                    'created_at': row[3],
-                    'chat_title': row[4]
-                }
-                for row in results
-            ]
+            return [HistoryRecord(*row) for row in results]
+
+    def get_last_history_id(self, user_id: int) -> Optional[int]:
+        """Возвращает id последней записи истории пользователя (по индексу, без сканирования)"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id FROM size_history
+                WHERE user_id = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ''', (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def get_user_size_series(self, user_id: int) -> List[Tuple[int, int]]:
+        """Возвращает всю траекторию размера: [(время, размер), ...] по возрастанию времени"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT created_at, old_size, new_size
+                FROM size_history
+                WHERE user_id = ?
+                ORDER BY created_at, id
+            ''', (user_id,))
+            rows = cursor.fetchall()
+        if not rows:
+            return []
+        # Начальная точка — размер до первого изменения
+        series = [(rows[0][0], rows[0][1])]
+        series.extend((row[0], row[2]) for row in rows)
+        return series
+
+    def get_global_stats(self, chat_id: Optional[int] = None, gainers_limit: int = 3) -> dict:
+        """Возвращает общую статистику из агрегатов (без сканирования size_history)"""
+        today = _day(_now())
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT bucket, users FROM stats_size_buckets WHERE users > 0 ORDER BY bucket')
+            histogram = cursor.fetchall()
+            
+            cursor.execute('SELECT rolls, new_players FROM stats_daily WHERE day = ?', (today,))
+            daily = cursor.fetchone() or (0, 0)
+            
+            chat_rolls = 0
+            gainers = []
+            if chat_id is not None:
+                cursor.execute(
+                    'SELECT rolls FROM stats_chat_daily WHERE chat_id = ? AND day = ?',
+                    (chat_id, today)
+                )
+                row = cursor.fetchone()
+                chat_rolls = row[0] if row else 0
+                cursor.execute('''
+                    SELECT s.user_id, u.username, u.first_name, s.gain
+                    FROM stats_chat_user_daily s
+                    LEFT JOIN users u ON u.user_id = s.user_id
+                    WHERE s.chat_id = ? AND s.day = ? AND s.gain > 0
+                    ORDER BY s.gain DESC
+                    LIMIT ?
+                ''', (chat_id, today, gainers_limit))
+                gainers = [
+                    {
+                        'user_id': row[0],
+                        'username': row[1],
+                        'first_name': row[2],
+                        'gain': row[3]
+                    }
+                    for row in cursor.fetchall()
+                ]
+            
+            return {
+                'total_players': sum(users for _, users in histogram),
+                'rolls_today': daily[0],
+                'new_players_today': daily[1],
+                'histogram': histogram,
+                'chat_rolls_today': chat_rolls,
+                'top_gainers_today': gainers
+            }
+
+    def get_daily_digest(self, day: Optional[int] = None, limit: int = 3) -> Dict[int, dict]:
+        """
+        Возвращает лидеров дня сразу по всем групповым чатам одним запросом:
+        {chat_id: {'rolls': ..., 'leaders': [...]}}
+        """
+        if day is None:
+            day = _day(_now())
+        digest: Dict[int, dict] = {}
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.arraysize = 1000
+            cursor.execute('''
+                SELECT chat_id, chat_rolls, user_id, username, first_name, gain
+                FROM (
+                    SELECT s.chat_id, d.rolls AS chat_rolls, s.user_id, u.username, u.first_name, s.gain,
+                           ROW_NUMBER() OVER (PARTITION BY s.chat_id ORDER BY s.gain DESC, s.user_id) AS place
+                    FROM stats_chat_user_daily s
+                    JOIN chats c ON c.chat_id = s.chat_id AND c.chat_type IN ('group', 'supergroup')
+                    JOIN stats_chat_daily d ON d.chat_id = s.chat_id AND d.day = s.day
+                    LEFT JOIN users u ON u.user_id = s.user_id
+                    WHERE s.day = ?
+                )
+                WHERE place <= ?
+                ORDER BY chat_id, place
+            ''', (day, limit))
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                for row in rows:
+                    entry = digest.setdefault(row[0], {'rolls': row[1], 'leaders': []})
+                    entry['leaders'].append({
+                        'user_id': row[2],
+                        'username': row[3],
+                        'first_name': row[4],
+                        'gain': row[5]
+                    })
+        return digest
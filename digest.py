@@ -0,0 +1,125 @@
+import time
+import asyncio
+import logging
+from datetime import time as dtime, timedelta, timezone
+from typing import Iterable, List, Tuple
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+from config import (
+    DIGEST_HOUR, DIGEST_MINUTE, DIGEST_TOP_N, DIGEST_CONCURRENCY, DIGEST_RATE_PER_SECOND
+)
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """В новых версиях PTB retry_after может быть timedelta"""
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class RateLimitedSender:
+    """
+    Рассылка с ограничением параллельности и частоты.
+    При ответе RetryAfter от Telegram вся рассылка ставится на паузу.
+    """
+
+    def __init__(self, bot, concurrency: int = DIGEST_CONCURRENCY,
+                 rate_per_second: float = DIGEST_RATE_PER_SECOND, max_attempts: int = 3):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _wait_for_slot(self):
+        """Равномерно распределяет отправки во времени"""
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _pause(self, seconds: float):
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+    async def send(self, chat_id: int, text: str) -> bool:
+        """Отправляет сообщение, возвращает True при успехе"""
+        async with self._semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                await self._wait_for_slot()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text)
+                    return True
+                except RetryAfter as e:
+                    delay = _retry_after_seconds(e)
+                    logger.warning(f"Флуд-лимит при отправке в {chat_id}, пауза {delay} с")
+                    self._pause(delay)
+                except (Forbidden, BadRequest) as e:
+                    # Бота удалили из чата или чат недоступен — повторять бессмысленно
+                    logger.info(f"Чат {chat_id} недоступен для рассылки: {e}")
+                    return False
+                except TelegramError as e:
+                    logger.warning(f"Ошибка отправки в {chat_id} (попытка {attempt}): {e}")
+            return False
+
+    async def send_all(self, messages: Iterable[Tuple[int, str]]) -> Tuple[int, int]:
+        """Отправляет все сообщения, возвращает (отправлено, не отправлено)"""
+        results = await asyncio.gather(*(self.send(chat_id, text) for chat_id, text in messages))
+        sent = sum(1 for ok in results if ok)
+        return sent, len(results) - sent
+
+
+class DailyDigest:
+    """Ежедневная сводка лидеров дня во все групповые чаты, где были броски"""
+
+    def __init__(self, db: Database, top_n: int = DIGEST_TOP_N):
+        self.db = db
+        self.top_n = top_n
+
+    @staticmethod
+    def format_digest(entry: dict) -> str:
+        message = (
+            f"📰 Итоги дня\n\n"
+            f"🎲 Бросков в чате: {entry['rolls']}\n"
+            f"📈 Лидеры дня:\n"
+        )
+        medals = ["🥇", "🥈", "🥉"]
+        for i, leader in enumerate(entry['leaders']):
+            user_name = leader['first_name'] or leader['username'] or f"Пользователь {leader['user_id']}"
+            medal = medals[i] if i < len(medals) else f"{i + 1}."
+            sign = "+" if leader['gain'] > 0 else ""
+            message += f"{medal} {user_name}: {sign}{leader['gain']}\n"
+        return message
+
+    def build_messages(self) -> List[Tuple[int, str]]:
+        """Собирает сообщения для всех чатов (один запрос к базе)"""
+        digest = self.db.get_daily_digest(limit=self.top_n)
+        return [(chat_id, self.format_digest(entry)) for chat_id, entry in digest.items()]
+
+    async def run(self, context: ContextTypes.DEFAULT_TYPE):
+        """Колбэк для job queue"""
+        started = time.monotonic()
+        messages = await asyncio.to_thread(self.build_messages)
+        if not messages:
+            logger.info("Ежедневная сводка: сегодня бросков в группах не было")
+            return
+        sent, failed = await RateLimitedSender(context.bot).send_all(messages)
+        logger.info(
+            f"Ежедневная сводка разослана: {sent} чатов, ошибок {failed}, "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+
+    def schedule(self, application):
+        """Регистрирует ежедневную задачу в job queue приложения"""
+        if application.job_queue is None:
+            logger.warning("Job queue недоступна: установите python-telegram-bot[job-queue]")
+            return
+        at = dtime(DIGEST_HOUR, DIGEST_MINUTE, tzinfo=timezone.utc)
+        application.job_queue.run_daily(self.run, time=at, name='daily_digest')
+        logger.info(f"Ежедневная сводка запланирована на {at.strftime('%H:%M')} UTC")
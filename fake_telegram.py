@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Локальный заменитель Telegram Bot API для сквозных и нагрузочных тестов.
+
+Понимает методы, которые вызывает бот: getMe, getUpdates (long polling),
+setWebhook/deleteWebhook/getWebhookInfo, sendMessage, sendPhoto, setMyCommands,
+answerInlineQuery; остальные методы отвечают true. Обновления от синтетических
+пользователей добавляются через inject_command, ответы бота записываются
+со временем отправки. С вероятностью flood_probability sendMessage отвечает
+429 с retry_after, как настоящий Telegram при превышении лимитов.
+
+Бот направляется сюда переменной TELEGRAM_API_BASE_URL (см. base_url).
+
+Пример (только сервер, обновления добавляются из кода):
+    python fake_telegram.py --port 8081
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+import urllib.request
+from collections import OrderedDict, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    'id': 100000001,
+    'is_bot': True,
+    'first_name': 'FakeTitsBot',
+    'username': 'fake_tits_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': True
+}
+
+# Эти параметры передаются строкой как есть; остальные PTB сериализует в JSON
+_RAW_PARAMS = {'text', 'caption', 'url', 'secret_token', 'inline_query_id', 'parse_mode'}
+_SEND_METHODS = {'sendmessage', 'sendphoto'}
+
+
+class Reply:
+    """Сообщение, отправленное ботом"""
+
+    __slots__ = ('method', 'chat_id', 'text', 'reply_to', 'sent_at', 'latency')
+
+    def __init__(self, method: str, chat_id: int, text: Optional[str], reply_to: Optional[int],
+                 sent_at: float, latency: Optional[float]):
+        self.method = method
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_to = reply_to
+        self.sent_at = sent_at
+        self.latency = latency
+
+
+def _decode_params(raw: Dict[str, str]) -> dict:
+    params = {}
+    for key, value in raw.items():
+        if key in _RAW_PARAMS or not isinstance(value, str):
+            params[key] = value
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def _parse_multipart(content_type: str, body: bytes) -> Dict[str, str]:
+    """Текстовые поля multipart/form-data (файлы пропускаются)"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name and not part.get_filename():
+            fields[name] = part.get_payload(decode=True).decode('utf-8', 'replace')
+    return fields
+
+
+class FakeTelegramServer:
+    """Поддельный Bot API в отдельном потоке (ThreadingHTTPServer)"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 flood_probability: float = 0.0, retry_after: int = 1, seed: Optional[int] = None):
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Condition()
+        self._updates: Deque[dict] = deque()
+        self._next_update_id = 1
+        self._message_ids: Dict[int, int] = {}
+        # Сообщения без ответа по чатам: message_id -> время добавления
+        self._unanswered: Dict[int, 'OrderedDict[int, float]'] = {}
+        self.replies: List[Reply] = []
+        self.calls: Dict[str, int] = {}
+        self.flood_responses = 0
+        self._last_send_at = 0.0
+        self.webhook_url: Optional[str] = None
+        self._webhook_secret: Optional[str] = None
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self._webhook_thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    @property
+    def base_url(self) -> str:
+        """Значение для TELEGRAM_API_BASE_URL"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        logger.info(f"Поддельный Bot API слушает {self.base_url}")
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # --- Синтетические обновления ---
+
+    def _next_message_id(self, chat_id: int) -> int:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        return message_id
+
+    def inject_command(self, user_id: int, chat_id: int, text: str, chat_title: Optional[str] = None) -> int:
+        """
+        Добавляет сообщение пользователя user_id в чат chat_id (chat_id == user_id — личка,
+        отрицательный — группа). Возвращает update_id
+        """
+        user = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+        if chat_id == user_id:
+            chat = {'id': chat_id, 'type': 'private', 'first_name': user['first_name']}
+        else:
+            chat = {'id': chat_id, 'type': 'supergroup', 'title': chat_title or f"Chat{-chat_id}"}
+        command_length = len(text.split()[0]) if text.startswith('/') else 0
+
+        with self._lock:
+            message_id = self._next_message_id(chat_id)
+            message = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': chat,
+                'from': user,
+                'text': text
+            }
+            if command_length:
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': command_length}]
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({'update_id': update_id, 'message': message})
+            self._unanswered.setdefault(chat_id, OrderedDict())[message_id] = time.monotonic()
+            self._lock.notify_all()
+        return update_id
+
+    def wait_for_replies(self, count: int, timeout: float, count_flood: bool = False) -> bool:
+        """
+        Ждет, пока бот отправит count сообщений. С count_flood отказы 429 тоже
+        засчитываются: PTB не повторяет такие отправки, ответ просто теряется
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self.replies) + (self.flood_responses if count_flood else 0) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def wait_for_idle(self, quiet: float, timeout: float) -> bool:
+        """Ждет, пока бот quiet секунд ничего не отправляет"""
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            idle_for = now - self._last_send_at
+            if idle_for >= quiet:
+                return True
+            if now >= deadline:
+                return False
+            time.sleep(min(quiet - idle_for, deadline - now))
+
+    def wait_for_call(self, method: str, timeout: float) -> bool:
+        """Ждет первого вызова метода (например, getUpdates — бот готов принимать обновления)"""
+        deadline = time.monotonic() + timeout
+        method = method.lower()
+        with self._lock:
+            while not self.calls.get(method):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    # --- Методы Bot API ---
+
+    def _take_updates(self, offset: Optional[int], limit: int, timeout: float) -> List[dict]:
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            # offset подтверждает все обновления до него
+            if offset is not None:
+                while self._updates and self._updates[0]['update_id'] < offset:
+                    self._updates.popleft()
+            while not self._updates and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    def _record_reply(self, method: str, params: dict) -> dict:
+        chat_id = int(params['chat_id'])
+        reply_to = params.get('reply_to_message_id')
+        if reply_to is None and isinstance(params.get('reply_parameters'), dict):
+            reply_to = params['reply_parameters'].get('message_id')
+        now = time.monotonic()
+        with self._lock:
+            latency = None
+            pending = self._unanswered.get(chat_id)
+            if pending:
+                # Без ссылки на сообщение считаем, что ответ на самое старое в чате
+                started = pending.pop(int(reply_to), None) if reply_to is not None else None
+                if started is None:
+                    started = pending.popitem(last=False)[1]
+                latency = now - started
+            text = params.get('text', params.get('caption'))
+            self.replies.append(Reply(method, chat_id, text, reply_to, now, latency))
+            message_id = self._next_message_id(chat_id)
+            self._lock.notify_all()
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+            'text': text or ''
+        }
+
+    def call(self, method: str, params: dict):
+        """Выполняет метод, возвращает (HTTP-статус, тело ответа)"""
+        method = method.lower()
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self._lock.notify_all()
+
+        if method == 'getme':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method == 'getupdates':
+            if self.webhook_url:
+                return 409, {'ok': False, 'error_code': 409,
+                             'description': "Conflict: can't use getUpdates method while webhook is active"}
+            updates = self._take_updates(params.get('offset'), int(params.get('limit') or 100),
+                                         float(params.get('timeout') or 0))
+            return 200, {'ok': True, 'result': updates}
+        if method == 'setwebhook':
+            self._set_webhook(params.get('url') or None, params.get('secret_token'))
+            return 200, {'ok': True, 'result': True}
+        if method == 'deletewebhook':
+            self._set_webhook(None, None)
+            return 200, {'ok': True, 'result': True}
+        if method == 'getwebhookinfo':
+            return 200, {'ok': True, 'result': {
+                'url': self.webhook_url or '',
+                'has_custom_certificate': False,
+                'pending_update_count': len(self._updates)
+            }}
+        if method in _SEND_METHODS:
+            self._last_send_at = time.monotonic()
+            if self.flood_probability and self._random.random() < self.flood_probability:
+                with self._lock:
+                    self.flood_responses += 1
+                    self._lock.notify_all()
+                return 429, {'ok': False, 'error_code': 429,
+                             'description': f"Too Many Requests: retry after {self.retry_after}",
+                             'parameters': {'retry_after': self.retry_after}}
+            return 200, {'ok': True, 'result': self._record_reply(method, params)}
+        # setMyCommands, answerInlineQuery, close и прочее
+        return 200, {'ok': True, 'result': True}
+
+    # --- Webhook ---
+
+    def _set_webhook(self, url: Optional[str], secret_token: Optional[str]):
+        with self._lock:
+            self.webhook_url = url
+            self._webhook_secret = secret_token
+            self._lock.notify_all()
+        if url and (self._webhook_thread is None or not self._webhook_thread.is_alive()):
+            self._webhook_thread = threading.Thread(target=self._deliver_webhook, name='fake-webhook', daemon=True)
+            self._webhook_thread.start()
+
+    def _deliver_webhook(self):
+        """Отправляет обновления POST-запросами на адрес webhook, пока он установлен"""
+        while True:
+            with self._lock:
+                while not self._updates and self.webhook_url and not self._stopping:
+                    self._lock.wait()
+                if not self.webhook_url or self._stopping:
+                    return
+                update = self._updates.popleft()
+                url, secret = self.webhook_url, self._webhook_secret
+            headers = {'Content-Type': 'application/json'}
+            if secret:
+                headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+            request = urllib.request.Request(url, json.dumps(update).encode(), headers)
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except OSError as e:
+                logger.warning(f"Webhook не принял обновление {update['update_id']}: {e}")
+                with self._lock:
+                    self._updates.appendleft(update)
+                time.sleep(0.5)
+
+    # --- HTTP ---
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело пишутся отдельно; с алгоритмом Нейгла и отложенным ACK
+            # каждый ответ на keep-alive соединении задерживался бы на ~40 мс
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                # Путь: /bot<токен>/<метод>
+                path = self.path.split('?', 1)[0]
+                parts = path.strip('/').split('/')
+                if len(parts) != 2 or not parts[0].startswith('bot'):
+                    self._respond(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('application/json'):
+                    raw = json.loads(body or b'{}')
+                elif content_type.startswith('multipart/form-data'):
+                    raw = _parse_multipart(content_type, body)
+                else:
+                    raw = dict(parse_qsl(body.decode('utf-8')))
+                if '?' in self.path:
+                    raw.update(parse_qsl(self.path.split('?', 1)[1]))
+                status, payload = server.call(parts[1], _decode_params(raw))
+                self._respond(status, payload)
+
+            def _respond(self, status: int, payload: dict):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Бот остановился посреди long polling
+                    self.close_connection = True
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Поддельный Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--flood-probability', type=float, default=0.0,
+                        help="доля sendMessage, на которые отвечать 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    server = FakeTelegramServer(args.host, args.port, args.flood_probability, args.retry_after)
+    server.start()
+    print(f"TELEGRAM_API_BASE_URL={server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
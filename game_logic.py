@@ -1,7 +1,23 @@
 import random
+from bisect import bisect_left
 from typing import Tuple
 from config import MIN_SIZE, MAX_SIZE, MIN_CHANGE, MAX_CHANGE, POSITIVE_PROBABILITY
 
+# Группы размеров: (верхняя граница включительно, описание). У последней границы нет
+SIZE_BUCKETS = (
+    (-80, "плоская как доска"),
+    (-60, "очень маленькая"),
+    (-40, "маленькая"),
+    (-20, "небольшая"),
+    (0, "средняя"),
+    (20, "хорошая"),
+    (40, "большая"),
+    (60, "очень большая"),
+    (80, "огромная"),
+    (None, "невероятно огромная"),
+)
+_SIZE_BUCKET_BOUNDS = [bound for bound, _ in SIZE_BUCKETS[:-1]]
+
 class GameLogic:
     @staticmethod
     def calculate_size_change() -> int:
@@ -39,31 +55,19 @@ class GameLogic:
         
         return new_size, actual_change
     
+    @staticmethod
+    def get_size_bucket(size: int) -> int:
+        """
+        Возвращает номер группы размера (0..len(SIZE_BUCKETS)-1), совпадающей с описанием
+        """
+        return bisect_left(_SIZE_BUCKET_BOUNDS, size)
+    
     @staticmethod
     def get_size_description(size: int) -> str:
         """
         Возвращает описание размера груди
         """
-        if size <= -80:
-            return "плоская как доска"
-        elif size <= -60:
-            return "очень маленькая"
-        elif size <= -40:
-            return "маленькая"
-        elif size <= -20:
-            return "небольшая"
-        elif size <= 0:
-            return "средняя"
-        elif size <= 20:
-            return "хорошая"
-        elif size <= 40:
-            return "большая"
-        elif size <= 60:
-            return "очень большая"
-        elif size <= 80:
-            return "огромная"
-        else:
-            return "невероятно огромная"
+        return SIZE_BUCKETS[GameLogic.get_size_bucket(size)][1]
     
     @staticmethod
     def get_change_description(change: int) -> str:
@@ -1,31 +1,27 @@
+import asyncio
 import logging
 import math
-from telegram import Update
+import time
+import weakref
+from typing import Optional, TYPE_CHECKING
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import ContextTypes
 from database import Database
-from game_logic import GameLogic
+from game_logic import GameLogic, SIZE_BUCKETS
+from charts import SizeChartCache, render_size_chart
 from config import ENFORCE_COOLDOWN, COOLDOWN_SECONDS, ADMIN_USER_IDS
 from datetime import datetime, timezone
 
+if TYPE_CHECKING:
+    from backup import DatabaseBackup
+    from leaderboard import LeaderboardService
 
-def _parse_sqlite_timestamp(timestamp_str: str) -> datetime:
-    """Парсит TIMESTAMP из SQLite в timezone-aware UTC datetime."""
-    # SQLite CURRENT_TIMESTAMP хранит в формате 'YYYY-MM-DD HH:MM:SS' в UTC
-    try:
-        dt = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-        return dt.replace(tzinfo=timezone.utc)
-    except ValueError:
-        # На всякий случай пробуем ISO-форматы
-        try:
-            # Обработка 'Z' → '+00:00'
-            normalized = timestamp_str.replace("Z", "+00:00")
-            dt2 = datetime.fromisoformat(normalized)
-            if dt2.tzinfo is None:
-                dt2 = dt2.replace(tzinfo=timezone.utc)
-            return dt2.astimezone(timezone.utc)
-        except Exception as _:
-            # Если совсем не распарсили — пробросим исключение
-            raise
+
+def _format_timestamp(timestamp: Optional[int]) -> Optional[str]:
+    """Форматирует время из базы (секунды Unix) как 'YYYY-MM-DD HH:MM:SS' в UTC."""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
 
 def _format_remaining(seconds_total: int) -> str:
@@ -44,9 +40,31 @@ def _format_remaining(seconds_total: int) -> str:
 logger = logging.getLogger(__name__)
 
 class BotHandlers:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, backup: Optional['DatabaseBackup'] = None,
+                 leaderboard: Optional['LeaderboardService'] = None):
         self.db = db
+        self.backup = backup
+        self.leaderboard = leaderboard
         self.game_logic = GameLogic()
+        self.chart_cache = SizeChartCache()
+        # Обновления обрабатываются параллельно; /tits одного пользователя — строго по очереди.
+        # Блокировка живет, пока ее кто-то держит или ждет
+        self._user_locks: 'weakref.WeakValueDictionary[int, asyncio.Lock]' = weakref.WeakValueDictionary()
+    
+    def _user_lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._user_locks[user_id] = lock
+        return lock
+    
+    async def _read(self, method, *args, **kwargs):
+        """Чтение из базы в отдельном потоке: цикл событий не ждет SQLite"""
+        return await asyncio.to_thread(method, *args, **kwargs)
+    
+    async def _write(self, method, *args, **kwargs):
+        """Изменение через поток-писатель: ждем его Future, не блокируя цикл событий"""
+        return await asyncio.wrap_future(method(*args, wait=False, **kwargs))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -54,14 +72,16 @@ class BotHandlers:
         chat = update.effective_chat
         
         # Сохраняем пользователя и чат в базе
-        user_data = self.db.get_or_create_user(
+        user_data = await self._write(
+            self.db.get_or_create_user,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name,
             last_name=user.last_name
         )
         
-        self.db.get_or_create_chat(
+        await self._write(
+            self.db.get_or_create_chat,
             chat_id=chat.id,
             chat_type=chat.type,
             title=chat.title
@@ -69,8 +89,8 @@ class BotHandlers:
         
         welcome_message = (
             f"Привет, {user.first_name}!\n"
-            f"Текущий размер: {user_data['breast_size']} ("
-            f"{self.game_logic.get_size_description(user_data['breast_size'])})\n"
+            f"Текущий размер: {user_data.breast_size} ("
+            f"{self.game_logic.get_size_description(user_data.breast_size)})\n"
             f"Команды: /tits /stats /top /history /help"
         )
         
@@ -78,11 +98,18 @@ class BotHandlers:
     
     async def tits_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /tits"""
+        # Иначе два одновременных /tits прочитали бы один и тот же размер и кулдаун
+        async with self._user_lock(update.effective_user.id):
+            await self._roll(update)
+    
+    async def _roll(self, update: Update):
+        """Бросок /tits (выполняется под блокировкой пользователя)"""
         user = update.effective_user
         chat = update.effective_chat
         
         # Получаем или создаем пользователя
-        user_data = self.db.get_or_create_user(
+        user_data = await self._write(
+            self.db.get_or_create_user,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name,
@@ -90,7 +117,8 @@ class BotHandlers:
         )
         
         # Получаем или создаем чат
-        self.db.get_or_create_chat(
+        await self._write(
+            self.db.get_or_create_chat,
             chat_id=chat.id,
             chat_type=chat.type,
             title=chat.title
@@ -98,38 +126,30 @@ class BotHandlers:
         
         # Проверка кулдауна (если включен)
         if ENFORCE_COOLDOWN:
-            last_used_str = self.db.get_last_tits_usage(user.id)
-            if last_used_str:
-                try:
-                    # TIMESTAMP в БД считаем как UTC
-                    last_used_dt = _parse_sqlite_timestamp(last_used_str)
-                    now_dt = datetime.now(timezone.utc)
-                    elapsed_seconds = (now_dt - last_used_dt).total_seconds()
-                    if elapsed_seconds < COOLDOWN_SECONDS:
-                        remaining = int(COOLDOWN_SECONDS - elapsed_seconds)
-                        await update.message.reply_text(
-                            f"Ещё рано. Повтори через {_format_remaining(remaining)} (кд {COOLDOWN_SECONDS // 3600} ч)"
-                        )
-                        return
-                except Exception as e:
-                    logger.warning(f"Не удалось разобрать время последнего использования /tits: {e}")
+            last_used = await self._read(self.db.get_last_tits_usage, user.id)
+            if last_used is not None:
+                # Время в БД — секунды Unix, как и time.time()
+                elapsed_seconds = time.time() - last_used
+                if elapsed_seconds < COOLDOWN_SECONDS:
+                    remaining = int(COOLDOWN_SECONDS - elapsed_seconds)
+                    await update.message.reply_text(
+                        f"Ещё рано. Повтори через {_format_remaining(remaining)} (кд {COOLDOWN_SECONDS // 3600} ч)"
+                    )
+                    return
 
         # Генерируем изменение размера
         change = self.game_logic.calculate_size_change()
         new_size, actual_change = self.game_logic.apply_size_change(
-            user_data['breast_size'], change
+            user_data.breast_size, change
         )
         
-        # Обновляем размер в базе
-        self.db.update_breast_size(user.id, new_size, actual_change, chat.id)
-        
-        # Формируем сообщение
+        # Формируем сообщение (место считаем заранее, чтобы записать ответ вместе с изменением)
         user_name = user.first_name or user.username or f"Пользователь {user.id}"
         
         # Рофельный, но аккуратный текст без эмодзи
         verb = "прибавила" if actual_change > 0 else "убавила"
         delta_word = "размеров" if abs(actual_change) != 1 else "размер"
-        rank = self.db.get_user_rank(user.id)
+        rank = await self._read(self.db.get_rank_for_size, user.id, new_size)
         rank_line = f"Твоё место в топе: {rank}" if rank else "В топ пока не попал"
         message = (
             f"{user_name}, твоя грудь {verb} на {abs(actual_change)} {delta_word}\n"
@@ -137,14 +157,25 @@ class BotHandlers:
             f"{rank_line}"
         )
         
+        # Обновляем размер в базе. В той же транзакции update_id отмечается обработанным
+        # и сохраняется ответ: если бот упадет до отправки, ответ уйдет при следующем запуске,
+        # а повторно доставленное обновление будет отброшено
+        await self._write(self.db.update_breast_size, user.id, new_size, actual_change, chat.id, pending_reply={
+            'update_id': update.update_id,
+            'chat_id': chat.id,
+            'message_id': update.message.message_id,
+            'text': message
+        })
+        
         await update.message.reply_text(message)
+        self.db.forget_pending_reply(update.update_id)
     
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /stats"""
         user = update.effective_user
         
         # Получаем статистику пользователя
-        stats = self.db.get_user_stats(user.id)
+        stats = await self._read(self.db.get_user_stats, user.id)
         
         if not stats:
             await update.message.reply_text("Статистика не найдена. Попробуйте использовать /tits сначала!")
@@ -158,8 +189,8 @@ class BotHandlers:
             f"({self.game_logic.get_size_description(stats['breast_size'])}) "
             f"{self.game_logic.get_emoji_for_size(stats['breast_size'])}\n\n"
             f"📈 Всего изменений: {stats['total_changes']}\n"
-            f"📅 Первое изменение: {stats['first_change'] or 'Нет данных'}\n"
-            f"🕐 Последнее изменение: {stats['last_change'] or 'Нет данных'}\n\n"
+            f"📅 Первое изменение: {_format_timestamp(stats['first_change']) or 'Нет данных'}\n"
+            f"🕐 Последнее изменение: {_format_timestamp(stats['last_change']) or 'Нет данных'}\n\n"
             f"Используйте /history для просмотра истории изменений"
         )
         
@@ -168,18 +199,22 @@ class BotHandlers:
     async def top_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /top"""
         # Получаем топ пользователей
-        top_users = self.db.get_top_users(10)
+        top_users = await self._read(self.db.get_top_users, 10)
         
         if not top_users:
             await update.message.reply_text("Пока нет данных для топ-листа. Попробуйте использовать /tits!")
             return
         
-        message = "🏆 Топ-10 пользователей по размеру груди:\n\n"
+        message = "🏆 Топ-10 пользователей по размеру груди:\n\n" + self._format_top(top_users)
         
+        await update.message.reply_text(message)
+    
+    def _format_top(self, top_users) -> str:
+        """Форматирует строки топ-листа"""
+        message = ""
         for i, user in enumerate(top_users, 1):
-            user_name = user['first_name'] or user['username'] or f"Пользователь {user['user_id']}"
-            size_desc = self.game_logic.get_size_description(user['breast_size'])
-            emoji = self.game_logic.get_emoji_for_size(user['breast_size'])
+            size_desc = self.game_logic.get_size_description(user.breast_size)
+            emoji = self.game_logic.get_emoji_for_size(user.breast_size)
             
             if i == 1:
                 medal = "🥇"
@@ -190,16 +225,20 @@ class BotHandlers:
             else:
                 medal = f"{i}."
             
-            message += f"{medal} {user_name}: {user['breast_size']} ({size_desc}) {emoji}\n"
-        
-        await update.message.reply_text(message)
+            message += f"{medal} {user.display_name}: {user.breast_size} ({size_desc}) {emoji}\n"
+        return message
     
     async def history_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /history"""
         user = update.effective_user
         
+        # /history chart — график размера вместо текста
+        if context.args and context.args[0].lower() in ('chart', 'график'):
+            await self._send_history_chart(update, user)
+            return
+        
         # Получаем историю изменений
-        history = self.db.get_user_history(user.id, 5)
+        history = await self._read(self.db.get_user_history, user.id, 5)
         
         if not history:
             await update.message.reply_text("История изменений не найдена. Попробуйте использовать /tits сначала!")
@@ -210,19 +249,135 @@ class BotHandlers:
         message = f"📜 История изменений {user_name}:\n\n"
         
         for i, record in enumerate(history, 1):
-            change_desc = self.game_logic.get_change_description(record['change_amount'])
-            emoji = self.game_logic.get_emoji_for_change(record['change_amount'])
-            chat_title = record['chat_title'] or "Неизвестный чат"
+            change_desc = self.game_logic.get_change_description(record.change_amount)
+            emoji = self.game_logic.get_emoji_for_change(record.change_amount)
+            chat_title = record.chat_title or "Неизвестный чат"
             
             message += (
                 f"{i}. {emoji} {change_desc}\n"
-                f"   Было: {record['old_size']} → Стало: {record['new_size']}\n"
+                f"   Было: {record.old_size} → Стало: {record.new_size}\n"
                 f"   Чат: {chat_title}\n"
-                f"   Дата: {record['created_at']}\n\n"
+                f"   Дата: {_format_timestamp(record.created_at)}\n\n"
             )
         
         await update.message.reply_text(message)
     
+    def _build_history_chart(self, user_id: int, user_name: str, last_history_id: int):
+        """Рисует график и кладет его в кэш (выполняется в отдельном потоке)"""
+        series = self.db.get_user_size_series(user_id)
+        png = render_size_chart(series)
+        sizes = [size for _, size in series]
+        caption = (
+            f"📈 {user_name}: {len(series) - 1} изменений, "
+            f"от {min(sizes)} до {max(sizes)}, сейчас {sizes[-1]}"
+        )
+        self.chart_cache.put(user_id, last_history_id, png, caption)
+        return png, caption
+    
+    async def _send_history_chart(self, update: Update, user):
+        """Отправляет график истории; перерисовывает только после нового /tits"""
+        last_history_id = await self._read(self.db.get_last_history_id, user.id)
+        if last_history_id is None:
+            await update.message.reply_text("История изменений не найдена. Попробуйте использовать /tits сначала!")
+            return
+        
+        cached = self.chart_cache.get(user.id, last_history_id)
+        if cached is None:
+            user_name = user.first_name or user.username or f"Пользователь {user.id}"
+            cached = await asyncio.to_thread(self._build_history_chart, user.id, user_name, last_history_id)
+        png, caption = cached
+        await update.message.reply_photo(photo=png, caption=caption)
+    
+    async def globalstats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /globalstats"""
+        chat = update.effective_chat
+        
+        # Все цифры берутся из агрегатов, которые обновляются при каждом /tits
+        stats = await self._read(self.db.get_global_stats, chat.id)
+        
+        if not stats['total_players']:
+            await update.message.reply_text("Пока нет данных для статистики. Попробуйте использовать /tits!")
+            return
+        
+        message = (
+            f"🌍 Общая статистика:\n\n"
+            f"👥 Всего игроков: {stats['total_players']}\n"
+            f"🎲 Бросков сегодня: {stats['rolls_today']}\n"
+            f"🆕 Новых игроков сегодня: {stats['new_players_today']}\n\n"
+            f"📊 Распределение размеров:\n"
+        )
+        
+        widest = max(users for _, users in stats['histogram'])
+        for bucket, users in stats['histogram']:
+            bar = "█" * max(1, round(users * 10 / widest))
+            message += f"{bar} {SIZE_BUCKETS[bucket][1]}: {users}\n"
+        
+        if chat.type != 'private':
+            message += f"\n💬 Бросков в этом чате сегодня: {stats['chat_rolls_today']}\n"
+            if stats['top_gainers_today']:
+                message += "📈 Прибавили больше всех сегодня:\n"
+                for i, gainer in enumerate(stats['top_gainers_today'], 1):
+                    user_name = gainer['first_name'] or gainer['username'] or f"Пользователь {gainer['user_id']}"
+                    message += f"{i}. {user_name}: +{gainer['gain']}\n"
+        
+        await update.message.reply_text(message)
+    
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Inline-режим (@bot top, @bot me): отвечает из снимка рейтинга, без запросов к базе"""
+        inline_query = update.inline_query
+        snapshot = self.leaderboard.snapshot if self.leaderboard else None
+        if snapshot is None:
+            # Снимок еще не построен — пустой ответ без кэширования
+            await inline_query.answer([], cache_time=0)
+            return
+        
+        query = inline_query.query.strip().lower()
+        want_top = query in ('', 'top', 'топ')
+        want_me = query in ('', 'me', 'я')
+        results = []
+        
+        if want_top and snapshot.top:
+            results.append(InlineQueryResultArticle(
+                id='top',
+                title="🏆 Топ игроков",
+                description=f"Всего игроков: {snapshot.total_players}",
+                input_message_content=InputTextMessageContent(
+                    f"🏆 Топ-{len(snapshot.top)} пользователей по размеру груди:\n\n"
+                    + self._format_top(snapshot.top)
+                )
+            ))
+        
+        if want_me:
+            user = inline_query.from_user
+            user_name = user.first_name or user.username or f"Пользователь {user.id}"
+            rank = snapshot.get_rank(user.id)
+            if rank:
+                place, size = rank
+                text = (
+                    f"{user_name}: размер {size} ({self.game_logic.get_size_description(size)}) "
+                    f"{self.game_logic.get_emoji_for_size(size)}\n"
+                    f"Место в топе: {place} из {snapshot.total_players}"
+                )
+                last_roll = snapshot.users.get(user.id)[1]
+                if last_roll:
+                    text += f"\nПоследний бросок: {_format_timestamp(last_roll)}"
+            else:
+                text = f"{user_name} еще не играл. Попробуй /tits!"
+            results.append(InlineQueryResultArticle(
+                id=f'me:{user.id}',
+                title="🍒 Мой размер и место",
+                description=text.split("\n")[0],
+                input_message_content=InputTextMessageContent(text)
+            ))
+        
+        # Telegram может кэшировать ответ до следующего обновления снимка;
+        # личный результат кэшируется отдельно для каждого пользователя
+        await inline_query.answer(
+            results,
+            cache_time=self.leaderboard.refresh_seconds,
+            is_personal=want_me
+        )
+    
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
         help_message = (
@@ -230,7 +385,8 @@ class BotHandlers:
             "/tits — изменить размер (−10…+10)\n"
             "/stats — твой текущий размер\n"
             "/top — таблица лидеров\n"
-            "/history — последние изменения\n"
+            "/history — последние изменения (/history chart — график)\n"
+            "/globalstats — общая статистика\n"
             "/help — эта справка"
         )
         
@@ -249,8 +405,27 @@ class BotHandlers:
             await update.message.reply_text("⛔ У вас нет прав для этой команды")
             return
         try:
-            self.db.reset_all_stats()
+            await self._write(self.db.reset_all_stats)
             await update.message.reply_text("✅ Вся статистика сброшена")
         except Exception as e:
             logger.exception("Ошибка при сбросе статистики")
             await update.message.reply_text("⚠️ Не удалось выполнить сброс. Проверьте логи")
+
+
+    async def backup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Админ-команда: сделать снапшот базы данных прямо сейчас."""
+        user = update.effective_user
+        if user.id not in ADMIN_USER_IDS:
+            await update.message.reply_text("⛔ У вас нет прав для этой команды")
+            return
+        backup = self.backup
+        if backup is None:
+            from backup import DatabaseBackup
+            backup = DatabaseBackup(self.db.db_path)
+        try:
+            # Копирование идет в отдельном потоке, чтобы не блокировать остальные команды
+            path = await asyncio.to_thread(backup.create_snapshot)
+            await update.message.reply_text(f"✅ Снапшот создан: {path}")
+        except Exception as e:
+            logger.exception("Ошибка при создании снапшота")
+            await update.message.reply_text("⚠️ Не удалось создать снапшот. Проверьте логи")
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Set
+from telegram import Update
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from config import PROCESSED_UPDATES_RING
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Отбрасывает повторно доставленные обновления Telegram.
+    Проверка идет по множеству в памяти; на диск update_id попадает только вместе
+    с изменением размера (в той же транзакции), поэтому лишних запросов к базе нет.
+    При запуске множество заполняется из кольцевой таблицы processed_updates.
+    """
+
+    def __init__(self, db: Database, capacity: int = PROCESSED_UPDATES_RING):
+        self.db = db
+        self._seen: Set[int] = set()
+        self._order: Deque[int] = deque()
+        self.capacity = capacity
+
+    def load(self):
+        """Загружает журнал обработанных обновлений из базы"""
+        for update_id in self.db.get_processed_update_ids():
+            self.remember(update_id)
+        logger.info(f"Загружено {len(self._seen)} обработанных обновлений")
+
+    def remember(self, update_id: int):
+        if update_id in self._seen:
+            return
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.capacity:
+            self._seen.discard(self._order.popleft())
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Проверяет и сразу запоминает update_id"""
+        if update_id in self._seen:
+            return True
+        self.remember(update_id)
+        return False
+
+    async def gate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Стоит перед всеми обработчиками (группа -2)"""
+        if self.is_duplicate(update.update_id):
+            logger.info(f"Обновление {update.update_id} уже обработано, пропускаем")
+            raise ApplicationHandlerStop
+
+    async def resend_pending_replies(self, bot):
+        """Отправляет ответы, которые были записаны в базу, но не ушли из-за остановки бота"""
+        pending = await asyncio.to_thread(self.db.get_pending_replies)
+        if not pending:
+            return
+        logger.info(f"Переотправляем {len(pending)} неотправленных ответов")
+        for reply in pending:
+            try:
+                try:
+                    await bot.send_message(
+                        chat_id=reply['chat_id'],
+                        text=reply['text'],
+                        reply_to_message_id=reply['message_id']
+                    )
+                except BadRequest:
+                    # Исходное сообщение могли удалить — отправляем без ответа на него
+                    await bot.send_message(chat_id=reply['chat_id'], text=reply['text'])
+            except (Forbidden, BadRequest) as e:
+                logger.info(f"Чат {reply['chat_id']} недоступен, ответ на {reply['update_id']} отброшен: {e}")
+            except TelegramError as e:
+                # Оставляем ответ в базе до следующего запуска
+                logger.warning(f"Не удалось переотправить ответ на обновление {reply['update_id']}: {e}")
+                continue
+            self.db.forget_pending_reply(reply['update_id'])
@@ -0,0 +1,84 @@
+import time
+import asyncio
+import logging
+from array import array
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+from telegram.ext import ContextTypes
+from config import LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_TOP_N
+from database import Database
+from records import UserColumns, UserRecord
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderboardSnapshot:
+    """
+    Неизменяемый снимок рейтинга: топ-N и таблица мест для всех игроков.
+    Игроки хранятся в UserColumns плюс отсортированная колонка размеров —
+    около 32 байт на игрока вместо словаря объектов.
+    """
+
+    __slots__ = ('top', 'built_at', 'users', '_sorted_sizes')
+
+    def __init__(self, top: List[UserRecord], users: UserColumns, built_at: float):
+        self.top = tuple(top)
+        self.built_at = built_at
+        self.users = users
+        self._sorted_sizes = array('q', sorted(users.sizes))
+
+    @property
+    def total_players(self) -> int:
+        return len(self.users)
+
+    def get_rank(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """Возвращает (место, размер) игрока или None, если его нет в снимке"""
+        state = self.users.get(user_id)
+        if state is None:
+            return None
+        size = state[0]
+        # Место = число игроков с бОльшим размером + 1, как в Database.get_user_rank
+        higher = len(self._sorted_sizes) - bisect_right(self._sorted_sizes, size)
+        return higher + 1, size
+
+    @classmethod
+    def build(cls, db: Database, top_n: int = LEADERBOARD_TOP_N) -> 'LeaderboardSnapshot':
+        """Строит снимок из базы (вызывается в фоновом потоке)"""
+        top, users = db.get_leaderboard(top_n)
+        return cls(top, users, time.time())
+
+
+class LeaderboardService:
+    """Держит актуальный снимок рейтинга и периодически его обновляет"""
+
+    def __init__(self, db: Database, refresh_seconds: int = LEADERBOARD_REFRESH_SECONDS,
+                 top_n: int = LEADERBOARD_TOP_N):
+        self.db = db
+        self.refresh_seconds = refresh_seconds
+        self.top_n = top_n
+        # Замена ссылки атомарна: читатели всегда видят целый снимок
+        self.snapshot: Optional[LeaderboardSnapshot] = None
+
+    def refresh(self):
+        started = time.monotonic()
+        self.snapshot = LeaderboardSnapshot.build(self.db, self.top_n)
+        logger.debug(
+            f"Снимок рейтинга обновлен: {self.snapshot.total_players} игроков "
+            f"за {time.monotonic() - started:.2f} с"
+        )
+
+    async def refresh_job(self, context: ContextTypes.DEFAULT_TYPE):
+        """Колбэк для job queue"""
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception:
+            logger.exception("Не удалось обновить снимок рейтинга")
+
+    def schedule(self, application):
+        """Регистрирует периодическое обновление в job queue приложения"""
+        if application.job_queue is None:
+            logger.warning("Job queue недоступна: снимок рейтинга для inline-режима не будет обновляться")
+            return
+        application.job_queue.run_repeating(
+            self.refresh_job, interval=self.refresh_seconds, first=0, name='leaderboard_refresh'
+        )
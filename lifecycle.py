@@ -0,0 +1,150 @@
+import signal
+import asyncio
+import logging
+import functools
+from typing import Awaitable, Callable, List, Optional, Union
+from config import SHUTDOWN_DRAIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Минимум времени на Application.stop(), даже если дренаж уже исчерпал лимит:
+# приложению нужно забрать сигнал остановки и остановить job queue
+STOP_GRACE_SECONDS = 1.0
+
+Cleanup = Callable[[], Union[None, Awaitable[None]]]
+
+
+class Lifecycle:
+    """
+    Управляет остановкой бота: по SIGTERM/SIGINT прекращает прием обновлений,
+    дожидается уже запущенных обработчиков (не дольше drain_timeout)
+    и выполняет зарегистрированные функции очистки (сброс буферов, закрытие соединений).
+    """
+
+    def __init__(self, drain_timeout: float = SHUTDOWN_DRAIN_SECONDS):
+        self.drain_timeout = drain_timeout
+        self._stop_event = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._in_flight = 0
+        self._cleanups: List[Cleanup] = []
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обработчиков, выполняющихся прямо сейчас"""
+        return self._in_flight
+
+    def install_signal_handlers(self):
+        """Подписывается на SIGTERM и SIGINT"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig)
+            except (NotImplementedError, RuntimeError):
+                # Windows: add_signal_handler не поддерживается
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.request_stop, signum))
+
+    def request_stop(self, sig: Optional[int] = None):
+        """Запрашивает остановку бота"""
+        if not self._stop_event.is_set():
+            name = signal.Signals(sig).name if sig else "запрос"
+            logger.info(f"Получен сигнал остановки ({name})")
+        self._stop_event.set()
+
+    async def wait(self):
+        """Ждет запроса на остановку"""
+        await self._stop_event.wait()
+
+    def register_cleanup(self, cleanup: Cleanup):
+        """Регистрирует функцию очистки. Выполняются в обратном порядке регистрации"""
+        self._cleanups.append(cleanup)
+
+    def track(self, callback):
+        """Оборачивает обработчик, чтобы учитывать его при ожидании завершения"""
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            self._in_flight += 1
+            self._idle.clear()
+            try:
+                return await callback(update, context)
+            finally:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle.set()
+        return wrapper
+
+    async def drain(self, application, deadline: Optional[float] = None) -> bool:
+        """Дожидается обработки уже полученных обновлений. False, если не успели"""
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + self.drain_timeout
+        while True:
+            if application.update_queue.empty() and self._idle.is_set():
+                return True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning(
+                    f"Не дождались завершения обработчиков за {self.drain_timeout} с: "
+                    f"в работе {self._in_flight}, в очереди {application.update_queue.qsize()}"
+                )
+                return False
+            if self._idle.is_set():
+                # Обработчики свободны, ждем, пока приложение заберет обновление из очереди
+                await asyncio.sleep(min(remaining, 0.05))
+                continue
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def discard_queued_updates(application) -> int:
+        """Выбрасывает необработанные обновления из очереди, возвращает их количество"""
+        dropped = 0
+        while True:
+            try:
+                application.update_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return dropped
+            application.update_queue.task_done()
+            dropped += 1
+
+    async def run_cleanups(self):
+        """Выполняет функции очистки; ошибка одной не мешает остальным"""
+        while self._cleanups:
+            cleanup = self._cleanups.pop()
+            try:
+                if asyncio.iscoroutinefunction(cleanup):
+                    await cleanup()
+                else:
+                    await asyncio.to_thread(cleanup)
+            except Exception:
+                logger.exception(f"Ошибка при выполнении {getattr(cleanup, '__qualname__', cleanup)}")
+
+    async def shutdown(self, application):
+        """Останавливает бота: прием → дренаж → остановка приложения → очистка"""
+        logger.info("Останавливаем прием обновлений...")
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        if await self.drain(application, deadline):
+            logger.info("Все полученные обновления обработаны")
+        else:
+            # Application.stop() ждет всю очередь (update_queue.join()) без ограничения
+            dropped = self.discard_queued_updates(application)
+            if dropped:
+                logger.warning(f"Отброшено необработанных обновлений: {dropped}")
+
+        if application.running:
+            try:
+                await asyncio.wait_for(
+                    application.stop(),
+                    timeout=max(deadline - loop.time(), STOP_GRACE_SECONDS)
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Приложение не остановилось вовремя, прерываем оставшиеся обработчики")
+        await self.run_cleanups()
+        await application.shutdown()
+        logger.info("Бот остановлен")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Сквозной нагрузочный тест: настоящий main.py против поддельного Bot API.
+
+Запускает FakeTelegramServer, стартует бота отдельным процессом с
+TELEGRAM_API_BASE_URL на этот сервер и временной базой, подает команды
+от синтетических пользователей в личках и группах и ждет ответов.
+Печатает пропускную способность (ответов в секунду) и задержку от
+появления обновления до ответа бота.
+
+Пример:
+    python loadtest.py --users 2000 --groups 100 --updates 10000 --flood-probability 0.01
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import List, Optional
+from fake_telegram import FakeTelegramServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMANDS = ('/tits', '/stats', '/top', '/history')
+# Начало ответа main.error_handler
+ERROR_REPLY_PREFIX = "😔"
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _bot_environment(base_url: str, db_path: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': '123456:LOADTEST',
+        'TELEGRAM_API_BASE_URL': base_url,
+        'DATABASE_PATH': db_path,
+        # Иначе почти все команды отсечет анти-спам или кулдаун
+        'THROTTLE_ENABLED': 'false',
+        'ENFORCE_COOLDOWN': 'false',
+        'BACKUP_ENABLED': 'false',
+        'DIGEST_ENABLED': 'false'
+    })
+    return env
+
+
+def run(users: int, groups: int, updates: int, rate: float, commands: List[str],
+        flood_probability: float, retry_after: int, timeout: float, seed: int,
+        verbose: bool = False) -> int:
+    rng = random.Random(seed)
+    server = FakeTelegramServer(flood_probability=flood_probability, retry_after=retry_after, seed=seed)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='titsbot-loadtest-')
+    bot = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')],
+        env=_bot_environment(server.base_url, os.path.join(workdir, 'loadtest.db')),
+        # Логи бота пишут строку на каждый запрос — по умолчанию не мешаем ими отчету
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=None if verbose else subprocess.DEVNULL
+    )
+    try:
+        if not server.wait_for_call('getUpdates', timeout=60):
+            logger.error("Бот не начал опрос обновлений за 60 с")
+            return 1
+
+        user_ids = [1_000_000 + i for i in range(users)]
+        group_ids = [-1_000_000_000_000 - i for i in range(groups)]
+        started = time.monotonic()
+        interval = 1.0 / rate if rate > 0 else 0.0
+        for i in range(updates):
+            user_id = rng.choice(user_ids)
+            chat_id = rng.choice(group_ids) if group_ids and rng.random() < 0.5 else user_id
+            server.inject_command(user_id, chat_id, rng.choice(commands))
+            if interval:
+                # Равномерная подача с заданной частотой
+                delay = started + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        injected_in = time.monotonic() - started
+
+        # После 429 бот отвечает сообщением об ошибке, поэтому отказы засчитываются не сразу:
+        # дожидаемся, пока бот перестанет отправлять
+        complete = server.wait_for_replies(updates, timeout, count_flood=True)
+        complete = server.wait_for_idle(1.0, timeout) and complete
+        elapsed = server.replies[-1].sent_at - started if server.replies else time.monotonic() - started
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            bot.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    replies = len(server.replies)
+    latencies = [reply.latency for reply in server.replies if reply.latency is not None]
+    print(f"Обновлений подано: {updates} за {injected_in:.2f} с "
+          f"({users} пользователей, {groups} групп)")
+    errors = sum(1 for reply in server.replies if (reply.text or '').startswith(ERROR_REPLY_PREFIX))
+    print(f"Ответов получено: {replies} (из них об ошибке: {errors}), "
+          f"без ответа: {max(0, updates - replies)}, ответов 429: {server.flood_responses}")
+    print(f"Время до последнего ответа: {elapsed:.2f} с, пропускная способность: "
+          f"{replies / elapsed if elapsed else 0:.1f} ответов/с")
+    print(f"Задержка, мс: p50 {_percentile(latencies, 50) * 1000:.1f}, "
+          f"p95 {_percentile(latencies, 95) * 1000:.1f}, "
+          f"p99 {_percentile(latencies, 99) * 1000:.1f}, "
+          f"max {max(latencies, default=0) * 1000:.1f}")
+    return 0 if complete else 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест TitsBot против поддельного Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="количество синтетических пользователей")
+    parser.add_argument('--groups', type=int, default=50, help="количество групповых чатов")
+    parser.add_argument('--updates', type=int, default=5000, help="сколько команд подать")
+    parser.add_argument('--rate', type=float, default=0.0, help="обновлений в секунду (0 — сразу все)")
+    parser.add_argument('--commands', default=','.join(DEFAULT_COMMANDS),
+                        help="команды через запятую, выбираются случайно")
+    parser.add_argument('--flood-probability', type=float, default=0.0,
+                        help="доля sendMessage, на которые сервер отвечает 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=120.0, help="сколько ждать ответов, с")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="показывать логи бота")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    commands = [command.strip() for command in args.commands.split(',') if command.strip()]
+    return run(args.users, args.groups, args.updates, args.rate, commands,
+               args.flood_probability, args.retry_after, args.timeout, args.seed, args.verbose)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
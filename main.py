@@ -1,10 +1,26 @@
+import time
+
+# Засекаем время запуска до тяжелых импортов (telegram.ext тянет httpx и др.)
+_STARTED_AT = time.perf_counter()
+
 import logging
 import asyncio
 from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import BOT_TOKEN
+from telegram.ext import (
+    Application, CommandHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters, ContextTypes
+)
+from config import (
+    require_bot_token, BACKUP_ENABLED, THROTTLE_ENABLED, DIGEST_ENABLED, TELEGRAM_API_BASE_URL,
+    CONCURRENT_UPDATES
+)
 from database import Database
 from handlers import BotHandlers
+from lifecycle import Lifecycle
+from throttle import CommandThrottle
+from leaderboard import LeaderboardService
+from idempotency import UpdateDeduplicator
+
+_IMPORTS_DONE_AT = time.perf_counter()
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,6 +29,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BOT_COMMANDS = [
+    ("start", "Запустить бота"),
+    ("tits", "Изменить размер груди"),
+    ("stats", "Показать статистику"),
+    ("top", "Топ пользователей"),
+    ("history", "История изменений"),
+    ("globalstats", "Общая статистика"),
+    ("help", "Справка"),
+]
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка при обработке обновления {update}: {context.error}")
@@ -22,28 +48,82 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "😔 Произошла ошибка при обработке команды. Попробуйте позже."
         )
 
+async def _post_start(application: Application, db: Database, deduplicator: UpdateDeduplicator):
+    """Отложенная инициализация: выполняется, когда бот уже принимает обновления"""
+    try:
+        await deduplicator.resend_pending_replies(application.bot)
+    except Exception as e:
+        logger.warning(f"Не удалось переотправить ответы: {e}")
+    try:
+        await application.bot.set_my_commands([BotCommand(name, desc) for name, desc in BOT_COMMANDS])
+        logger.info("Команды бота настроены")
+    except Exception as e:
+        logger.warning(f"Не удалось настроить команды бота: {e}")
+    try:
+        await asyncio.to_thread(db.warm_up)
+        logger.info("Кэш базы данных прогрет")
+    except Exception as e:
+        logger.warning(f"Не удалось прогреть кэш базы данных: {e}")
+
 async def main():
     """Главная функция"""
     try:
+        logger.info(f"Импорт модулей занял {_IMPORTS_DONE_AT - _STARTED_AT:.3f} с")
+        token = require_bot_token()
+        
         # Инициализируем базу данных и обработчики
+        # (при актуальной схеме DDL не выполняется — см. Database.init_database)
         db = Database()
-        handlers = BotHandlers(db)
+        backup = None
+        if BACKUP_ENABLED:
+            from backup import DatabaseBackup
+            backup = DatabaseBackup(db.db_path)
+        leaderboard = LeaderboardService(db)
+        handlers = BotHandlers(db, backup, leaderboard)
         
         # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).build()
+        # Обновления обрабатываются параллельно: медленный /top не ждет чужих /tits
+        application = (
+            Application.builder()
+            .token(token)
+            .base_url(TELEGRAM_API_BASE_URL)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .build()
+        )
+        
+        # Все обработчики учитываются при ожидании завершения (см. Lifecycle.drain)
+        lifecycle = Lifecycle()
+        track = lifecycle.track
+        # Закрывается последним: сначала дописывается очередь изменений
+        lifecycle.register_cleanup(db.close)
+        
+        # Повторно доставленные обновления отбрасываются раньше всего (группа -2)
+        deduplicator = UpdateDeduplicator(db)
+        deduplicator.load()
+        application.add_handler(TypeHandler(Update, deduplicator.gate), group=-2)
+        
+        # Анти-спам стоит перед всеми обработчиками (группа -1)
+        if THROTTLE_ENABLED:
+            application.add_handler(TypeHandler(Update, CommandThrottle().gate), group=-1)
         
         # Настраиваем обработчики команд
-        application.add_handler(CommandHandler("start", handlers.start_command))
-        application.add_handler(CommandHandler("tits", handlers.tits_command))
-        application.add_handler(CommandHandler("stats", handlers.stats_command))
-        application.add_handler(CommandHandler("top", handlers.top_command))
-        application.add_handler(CommandHandler("history", handlers.history_command))
-        application.add_handler(CommandHandler("help", handlers.help_command))
-        application.add_handler(CommandHandler("reset_all", handlers.reset_all_command))
+        application.add_handler(CommandHandler("start", track(handlers.start_command)))
+        application.add_handler(CommandHandler("tits", track(handlers.tits_command)))
+        application.add_handler(CommandHandler("stats", track(handlers.stats_command)))
+        application.add_handler(CommandHandler("top", track(handlers.top_command)))
+        application.add_handler(CommandHandler("history", track(handlers.history_command)))
+        application.add_handler(CommandHandler("globalstats", track(handlers.globalstats_command)))
+        application.add_handler(CommandHandler("help", track(handlers.help_command)))
+        application.add_handler(CommandHandler("reset_all", track(handlers.reset_all_command)))
+        application.add_handler(CommandHandler("backup", track(handlers.backup_command)))
+        
+        # Inline-режим: ответы из снимка рейтинга, обновляемого по расписанию
+        application.add_handler(InlineQueryHandler(track(handlers.inline_query)))
+        leaderboard.schedule(application)
         
         # Обработчик неизвестных команд (должен быть последним)
         application.add_handler(
-            MessageHandler(filters.COMMAND, handlers.unknown_command)
+            MessageHandler(filters.COMMAND, track(handlers.unknown_command))
         )
         
         # Обработчик ошибок
@@ -51,34 +131,33 @@ async def main():
         
         logger.info("Обработчики команд настроены")
         
-        # Настраиваем команды бота
-        commands = [
-            BotCommand("start", "Запустить бота"),
-            BotCommand("tits", "Изменить размер груди"),
-            BotCommand("stats", "Показать статистику"),
-            BotCommand("top", "Топ пользователей"),
-            BotCommand("history", "История изменений"),
-            BotCommand("help", "Справка")
-        ]
-        
-        await application.bot.set_my_commands(commands)
-        logger.info("Команды бота настроены")
+        # Ежедневная сводка по чатам (job queue запускается вместе с приложением)
+        if DIGEST_ENABLED:
+            from digest import DailyDigest
+            DailyDigest(db).schedule(application)
         
-        # Запускаем бота
+        # Запускаем бота как можно раньше, остальное доделываем в фоне
         logger.info("Бот запускается...")
         await application.initialize()
         await application.start()
         await application.updater.start_polling()
+        lifecycle.install_signal_handlers()
+        logger.info(f"Бот принимает обновления через {time.perf_counter() - _STARTED_AT:.3f} с после запуска")
+        
+        # Настройка команд и прогрев кэша не задерживают прием обновлений
+        post_start_task = asyncio.create_task(_post_start(application, db, deduplicator))
+        
+        # Снапшоты базы по расписанию в фоновом потоке
+        if backup:
+            backup.start()
+            lifecycle.register_cleanup(backup.stop)
         
-        # Ждем завершения
+        # Ждем SIGTERM/SIGINT, затем останавливаемся без потери начатых команд
         try:
-            await asyncio.Event().wait()
-        except KeyboardInterrupt:
-            pass
+            await lifecycle.wait()
         finally:
-            await application.updater.stop()
-            await application.stop()
-            await application.shutdown()
+            post_start_task.cancel()
+            await lifecycle.shutdown(application)
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
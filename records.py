@@ -0,0 +1,105 @@
+from array import array
+from bisect import bisect_left
+from typing import Optional, Tuple
+
+
+class UserRecord:
+    """
+    Запись пользователя. __slots__ вместо словаря: без __dict__ на каждый объект,
+    поэтому закэшированные записи занимают в несколько раз меньше памяти.
+    """
+
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'breast_size',
+                 'created_at', 'updated_at')
+
+    def __init__(self, user_id: int, username: Optional[str] = None, first_name: Optional[str] = None,
+                 last_name: Optional[str] = None, breast_size: int = 0,
+                 created_at: Optional[int] = None, updated_at: Optional[int] = None):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.breast_size = breast_size
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @property
+    def display_name(self) -> str:
+        return self.first_name or self.username or f"Пользователь {self.user_id}"
+
+    def __repr__(self):
+        return f"UserRecord(user_id={self.user_id}, breast_size={self.breast_size})"
+
+
+class HistoryRecord:
+    """Запись истории изменений размера"""
+
+    __slots__ = ('old_size', 'new_size', 'change_amount', 'created_at', 'chat_title')
+
+    def __init__(self, old_size: int, new_size: int, change_amount: int,
+                 created_at: Optional[int], chat_title: Optional[str] = None):
+        self.old_size = old_size
+        self.new_size = new_size
+        self.change_amount = change_amount
+        self.created_at = created_at
+        self.chat_title = chat_title
+
+    def __repr__(self):
+        return f"HistoryRecord({self.old_size} -> {self.new_size}, created_at={self.created_at})"
+
+
+class UserColumns:
+    """
+    Колоночное хранилище состояния игроков: user_id (по возрастанию), размер и время
+    последнего броска (0 — бросков не было) в трех массивах array('q').
+    24 байта на игрока против сотен байт у словаря или объекта.
+    """
+
+    __slots__ = ('user_ids', 'sizes', 'last_rolls')
+
+    def __init__(self):
+        self.user_ids = array('q')
+        self.sizes = array('q')
+        self.last_rolls = array('q')
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Объем данных в массивах (без учета запаса, который array держит для роста)"""
+        return len(self.user_ids) * (self.user_ids.itemsize + self.sizes.itemsize + self.last_rolls.itemsize)
+
+    def append(self, user_id: int, size: int, last_roll: Optional[int] = None):
+        """Добавляет игрока в конец; user_id должны идти по возрастанию (как из iter_user_states)"""
+        if self.user_ids and user_id <= self.user_ids[-1]:
+            raise ValueError(f"user_id {user_id} нарушает порядок колонок")
+        self.user_ids.append(user_id)
+        self.sizes.append(size or 0)
+        self.last_rolls.append(last_roll or 0)
+
+    def index(self, user_id: int) -> int:
+        """Позиция игрока в колонках или -1"""
+        i = bisect_left(self.user_ids, user_id)
+        if i == len(self.user_ids) or self.user_ids[i] != user_id:
+            return -1
+        return i
+
+    def get(self, user_id: int) -> Optional[Tuple[int, Optional[int]]]:
+        """Возвращает (размер, время последнего броска) или None"""
+        i = self.index(user_id)
+        if i < 0:
+            return None
+        return self.sizes[i], self.last_rolls[i] or None
+
+    def set(self, user_id: int, size: int, last_roll: Optional[int] = None):
+        """Обновляет игрока или вставляет его, сохраняя порядок user_id"""
+        i = bisect_left(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            self.sizes[i] = size
+            if last_roll is not None:
+                self.last_rolls[i] = last_roll
+            return
+        self.user_ids.insert(i, user_id)
+        self.sizes.insert(i, size)
+        self.last_rolls.insert(i, last_roll or 0)
@@ -7,7 +7,30 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import json
+import shutil
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import ApplicationHandlerStop
 from database import Database
+from backup import DatabaseBackup
+from transfer import TargetNotEmpty, export_all, import_all
+from throttle import CommandThrottle
+from charts import SizeChartCache, lttb, render_size_chart
+from leaderboard import LeaderboardSnapshot
+from records import UserColumns
+from idempotency import UpdateDeduplicator
+from fake_telegram import FakeTelegramServer
+from lifecycle import Lifecycle
+import handlers
 from game_logic import GameLogic
 
 def test_database():
@@ -41,7 +64,7 @@ def test_database():
         # Тест 3: Обновление размера груди
         print("\n3. Тест обновления размера груди...")
         change = game_logic.calculate_size_change()
-        new_size, actual_change = game_logic.apply_size_change(user['breast_size'], change)
+        new_size, actual_change = game_logic.apply_size_change(user.breast_size, change)
         
         success = db.update_breast_size(12345, new_size, actual_change, 67890)
         print(f"✅ Размер обновлен: {success}")
@@ -82,9 +105,13 @@ def test_database():
         return False
     
     finally:
-        # Удаляем тестовую базу данных
+        # Удаляем тестовую базу данных (вместе с файлами WAL)
+        db.close()
         try:
             os.remove("test_titsbot.db")
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists("test_titsbot.db" + suffix):
+                    os.remove("test_titsbot.db" + suffix)
             print("\n🧹 Тестовая база данных удалена")
         except:
             pass
@@ -134,13 +161,603 @@ def test_game_logic():
         print(f"❌ Ошибка при тестировании игровой логики: {e}")
         return False
 
+def test_backup():
+    """Тестирует онлайн-снапшоты и ротацию"""
+    print("\n💾 Тестирование резервного копирования...")
+    
+    workdir = tempfile.mkdtemp()
+    db = None
+    try:
+        db = Database(os.path.join(workdir, "test_titsbot.db"))
+        db.get_or_create_user(user_id=1, username="a")
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        db.update_breast_size(1, 5, 5, 10)
+        
+        backup = DatabaseBackup(db.db_path, os.path.join(workdir, "backups"), keep=2)
+        paths = []
+        for i in range(3):
+            # Имена снапшотов содержат секунды, поэтому подменяем их вручную
+            path = backup.create_snapshot()
+            renamed = os.path.join(backup.backup_dir, f"titsbot-0000000{i}-000000.db")
+            os.replace(path, renamed)
+            paths.append(renamed)
+        backup.rotate()
+        
+        snapshots = backup.list_snapshots()
+        assert snapshots == paths[1:], snapshots
+        with sqlite3.connect(snapshots[-1]) as conn:
+            size = conn.execute("SELECT breast_size FROM users WHERE user_id = 1").fetchone()[0]
+        assert size == 5
+        print(f"✅ Снапшоты созданы и ротированы: {len(snapshots)} шт.")
+        
+        # Снапшот должен завершаться, пока бот непрерывно пишет в базу
+        db.submit_write(lambda conn: conn.executemany(
+            "INSERT INTO size_history (user_id, chat_id, old_size, new_size, change_amount, created_at) "
+            "VALUES (1, 10, 0, 1, 1, ?)", ((i,) for i in range(200000))
+        )).result()
+        stop = threading.Event()
+        started = threading.Event()
+        writes = []
+        
+        def keep_writing():
+            while not stop.is_set():
+                db.update_breast_size(1, len(writes), 1, 10)
+                writes.append(1)
+                started.set()
+        
+        result = []
+        writer = threading.Thread(target=keep_writing)
+        writer.start()
+        try:
+            started.wait(5)
+            # Поэтапное копирование перезапускалось бы после каждой записи и не заканчивалось
+            snapshot = threading.Thread(target=lambda: result.append(backup.create_snapshot()), daemon=True)
+            snapshot.start()
+            snapshot.join(30)
+        finally:
+            stop.set()
+            writer.join()
+        assert result, "Снапшот не завершился во время записи"
+        path = result[0]
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+            assert conn.execute("SELECT COUNT(*) FROM size_history").fetchone()[0] > 200000
+        print(f"✅ Снапшот завершен при {len(writes)} параллельных записях")
+        return True
+    finally:
+        if db:
+            db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_transfer():
+    """Тестирует экспорт/импорт таблиц между базами"""
+    print("\n📦 Тестирование экспорта/импорта...")
+    
+    workdir = tempfile.mkdtemp()
+    # Все открытые базы закрываются в finally: иначе остаются потоки-писатели и файлы
+    databases = []
+    try:
+        source = Database(os.path.join(workdir, "source.db"))
+        databases.append(source)
+        source.get_or_create_chat(chat_id=10, chat_type="group", title="Chat, \"quoted\"")
+        for user_id in range(1, 6):
+            source.get_or_create_user(user_id=user_id, username=f"user{user_id}")
+            source.update_breast_size(user_id, user_id, user_id, 10)
+        
+        for fmt, compress in (("ndjson", True), ("csv", False)):
+            dump_dir = os.path.join(workdir, f"dump_{fmt}")
+            exported = export_all(source.db_path, dump_dir, fmt, compress, chunk_size=2)
+            target = Database(os.path.join(workdir, f"target_{fmt}.db"))
+            databases.append(target)
+            imported = import_all(target.db_path, dump_dir, chunk_size=2)
+            assert exported == imported == {"chats": 1, "users": 5, "size_history": 5}, (exported, imported)
+            assert target.get_top_users(1)[0].breast_size == 5
+            assert target.get_user_history(3)[0].chat_title == "Chat, \"quoted\""
+            assert target.get_user_stats(2)["last_name"] is None
+            print(f"✅ {fmt}: перенесено {imported}")
+        
+        # Повторный импорт в базу с данными отклоняется и ничего не меняет
+        try:
+            import_all(target.db_path, dump_dir)
+            assert False, "Импорт в непустую базу должен отклоняться"
+        except TargetNotEmpty:
+            pass
+        assert len(target.get_user_history(2)) == 1
+        return True
+    finally:
+        for db in databases:
+            db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_throttle():
+    """Тестирует анти-спам для команд"""
+    print("\n🚦 Тестирование анти-спама...")
+    
+    throttle = CommandThrottle(user_limit=3, user_window=10, chat_limit=4, chat_window=10, duplicate_window=2)
+    # Повтор той же команды сразу же схлопывается
+    assert throttle.allow(1, 100, "/top", now=0.0)
+    assert not throttle.allow(1, 100, "/top", now=1.0)
+    # Лимит на пользователя: 3 команды за 10 секунд
+    assert throttle.allow(1, 100, "/stats", now=1.5)
+    assert throttle.allow(1, 100, "/history", now=2.0)
+    assert not throttle.allow(1, 100, "/help", now=2.5)
+    # Лимит на чат: 4 команды за 10 секунд от разных пользователей
+    assert throttle.allow(2, 100, "/top", now=3.0)
+    assert not throttle.allow(3, 100, "/top", now=3.5)
+    # Окно скользит
+    assert throttle.allow(1, 100, "/help", now=11.0)
+    
+    # Отредактированная команда проходит через тот же лимит
+    throttle = CommandThrottle(user_limit=1, user_window=60, chat_limit=100, chat_window=60, duplicate_window=0)
+    user = User(id=5, first_name="E", is_bot=False)
+    chat = Chat(id=500, type="private")
+    
+    async def edit(update_id):
+        message = Message(message_id=1, date=datetime.now(timezone.utc), chat=chat, from_user=user,
+                          text=f"/top {update_id}")
+        await throttle.gate(Update(update_id=update_id, edited_message=message), None)
+    
+    asyncio.run(edit(1))
+    try:
+        asyncio.run(edit(2))
+        assert False, "Отредактированная команда сверх лимита должна отбрасываться"
+    except ApplicationHandlerStop:
+        pass
+    print("✅ Лимиты соблюдаются")
+    return True
+
+def test_timestamp_migration():
+    """Тестирует перевод текстового времени старой схемы в секунды Unix"""
+    print("\n🕐 Тестирование миграции времени...")
+    
+    workdir = tempfile.mkdtemp()
+    db = None
+    try:
+        path = os.path.join(workdir, "old.db")
+        # База, созданная версией бота с текстовым CURRENT_TIMESTAMP
+        with sqlite3.connect(path) as conn:
+            conn.execute("""CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT,
+                last_name TEXT, breast_size INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+            conn.execute("""CREATE TABLE chats (chat_id INTEGER PRIMARY KEY, chat_type TEXT, title TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+            conn.execute("""CREATE TABLE size_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                chat_id INTEGER, old_size INTEGER, new_size INTEGER, change_amount INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+            conn.execute("INSERT INTO users (user_id, breast_size, created_at, updated_at) "
+                         "VALUES (1, 3, '2024-01-01 00:00:00', '2024-01-01 00:00:00')")
+            conn.execute("INSERT INTO size_history (user_id, chat_id, old_size, new_size, change_amount, created_at) "
+                         "VALUES (1, 10, 0, 3, 3, '2024-01-01 00:00:00')")
+        
+        db = Database(path)
+        assert db.get_last_tits_usage(1) == 1704067200
+        stats = db.get_user_stats(1)
+        assert stats["created_at"] == stats["first_change"] == 1704067200
+        db.update_breast_size(1, 5, 2, 10)
+        assert isinstance(db.get_user_history(1, 1)[0].created_at, int)
+        print("✅ Время переведено в секунды Unix")
+        return True
+    finally:
+        if db:
+            db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_read_write_split():
+    """Тестирует единственного писателя и пул читателей"""
+    print("\n🔀 Тестирование разделения чтения и записи...")
+    
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "split.db")
+        db = Database(path, read_pool_size=2)
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        for user_id in range(8):
+            db.get_or_create_user(user_id=user_id)
+        
+        def roll(user_id):
+            for size in range(1, 26):
+                db.update_breast_size(user_id, size, 1, 10)
+                db.get_top_users(3)
+        
+        threads = [threading.Thread(target=roll, args=(user_id,)) for user_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # Соединения из пула только читают
+        with db.read_connection() as conn:
+            try:
+                conn.execute("DELETE FROM users")
+                assert False, "read-only соединение выполнило запись"
+            except sqlite3.OperationalError:
+                pass
+        
+        # Изменения, поставленные в очередь без ожидания, дописываются при закрытии
+        db.submit_write(lambda conn: conn.execute("UPDATE users SET breast_size = 100 WHERE user_id = 0"))
+        db.close()
+        
+        reopened = Database(path)
+        assert reopened.get_user_stats(3)["total_changes"] == 25
+        assert reopened.get_top_users(1)[0].breast_size == 100
+        reopened.close()
+        print("✅ 200 изменений из 8 потоков записаны, чтение не блокируется")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_analytics():
+    """Тестирует инкрементальные агрегаты для /globalstats"""
+    print("\n🌍 Тестирование агрегатов статистики...")
+    
+    workdir = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(workdir, "analytics.db"))
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        db.get_or_create_chat(chat_id=20, chat_type="group", title="Other")
+        sizes = {}
+        for user_id in range(1, 6):
+            db.get_or_create_user(user_id=user_id, first_name=f"U{user_id}")
+            sizes[user_id] = 0
+        for step in range(40):
+            user_id = step % 5 + 1
+            change = GameLogic.calculate_size_change() * (user_id if step % 2 else 3)
+            new_size, actual = GameLogic.apply_size_change(sizes[user_id], change)
+            db.update_breast_size(user_id, new_size, actual, 10 if step % 3 else 20)
+            sizes[user_id] = new_size
+        
+        incremental = db.get_global_stats(10)
+        assert incremental["total_players"] == 5
+        assert incremental["rolls_today"] == 40
+        assert incremental["new_players_today"] == 5
+        expected = {}
+        for size in sizes.values():
+            bucket = GameLogic.get_size_bucket(size)
+            expected[bucket] = expected.get(bucket, 0) + 1
+        assert dict(incremental["histogram"]) == expected
+        
+        # Пересчет с нуля должен дать то же самое
+        db.rebuild_analytics()
+        assert db.get_global_stats(10) == incremental
+        
+        # Сводка для рассылки: оба групповых чата одним запросом, лидеры по убыванию
+        digest = db.get_daily_digest(limit=2)
+        assert set(digest) == {10, 20}
+        assert digest[10]["rolls"] == incremental["chat_rolls_today"]
+        gains = [leader["gain"] for leader in digest[10]["leaders"]]
+        assert len(gains) == 2 and gains == sorted(gains, reverse=True)
+        db.close()
+        print(f"✅ Агрегаты совпадают с пересчетом: {incremental['histogram']}")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_history_chart():
+    """Тестирует график истории, прореживание и кэш"""
+    print("\n📈 Тестирование графиков истории...")
+    
+    workdir = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(workdir, "chart.db"))
+        db.get_or_create_user(user_id=1)
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        size = 0
+        for _ in range(50):
+            new_size, actual = GameLogic.apply_size_change(size, GameLogic.calculate_size_change())
+            db.update_breast_size(1, new_size, actual, 10)
+            size = new_size
+        
+        series = db.get_user_size_series(1)
+        assert len(series) == 51 and series[0][1] == 0 and series[-1][1] == size
+        
+        # Прореживание сохраняет крайние точки и глобальный максимум
+        points = [(i, (i * 37) % 101) for i in range(2000)]
+        sampled = lttb(points, 100)
+        assert len(sampled) == 100 and sampled[0] == points[0] and sampled[-1] == points[-1]
+        assert max(y for _, y in sampled) == 100
+        
+        png = render_size_chart(series)
+        assert png.startswith(b"\x89PNG\r\n\x1a\n")
+        
+        # Кэш действителен до следующего изменения
+        cache = SizeChartCache(max_entries=1)
+        last_id = db.get_last_history_id(1)
+        cache.put(1, last_id, png, "caption")
+        assert cache.get(1, last_id) == (png, "caption")
+        db.update_breast_size(1, size + 1, 1, 10)
+        assert cache.get(1, db.get_last_history_id(1)) is None
+        cache.put(2, 1, png, "other")
+        assert cache.get(1, last_id) is None
+        db.close()
+        print(f"✅ График {len(png)} байт, кэш сбрасывается после нового броска")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_leaderboard_snapshot():
+    """Тестирует снимок рейтинга для inline-режима"""
+    print("\n🏆 Тестирование снимка рейтинга...")
+    
+    workdir = tempfile.mkdtemp()
+    try:
+        db = Database(os.path.join(workdir, "leaderboard.db"))
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        for user_id in range(1, 31):
+            db.get_or_create_user(user_id=user_id * 7, first_name=f"U{user_id}")
+            # Одинаковые размеры у нескольких игроков делят место
+            db.update_breast_size(user_id * 7, (user_id * 13) % 11 - 5, 1, 10)
+        
+        snapshot = LeaderboardSnapshot.build(db, top_n=5)
+        assert snapshot.total_players == 30
+        assert [user.user_id for user in snapshot.top] == [user.user_id for user in db.get_top_users(5)]
+        for user_id in range(1, 31):
+            place, size = snapshot.get_rank(user_id * 7)
+            assert place == db.get_user_rank(user_id * 7)
+        assert snapshot.get_rank(8) is None
+        assert snapshot.users.get(7)[1] == db.get_last_tits_usage(7)
+        db.close()
+        
+        # Бросок между чтением топа и колонок не должен попасть в снимок наполовину
+        class RacingDatabase(Database):
+            def _iter_user_states(self, cursor):
+                self.update_breast_size(7, 1000, 1000, 10)
+                return Database._iter_user_states(cursor)
+        
+        racing = RacingDatabase(os.path.join(workdir, "leaderboard.db"))
+        try:
+            snapshot = LeaderboardSnapshot.build(racing, top_n=5)
+            leader = snapshot.top[0]
+            assert snapshot.get_rank(leader.user_id) == (1, leader.breast_size)
+            assert snapshot.users.get(7)[0] != 1000
+        finally:
+            racing.close()
+        
+        # Колонки сохраняют порядок user_id при вставке
+        columns = UserColumns()
+        for user_id in (5, 1, 3):
+            columns.set(user_id, user_id * 10)
+        columns.set(3, 31, last_roll=100)
+        assert list(columns.user_ids) == [1, 3, 5]
+        assert columns.get(3) == (31, 100)
+        assert columns.get(1) == (10, None)
+        assert columns.get(2) is None
+        print("✅ Места в снимке совпадают с базой")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_idempotency():
+    """Тестирует отбрасывание повторных обновлений и переотправку ответов"""
+    print("\n🔁 Тестирование обработки ровно один раз...")
+    
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+        
+        async def send_message(self, chat_id, text, reply_to_message_id=None):
+            self.sent.append((chat_id, text, reply_to_message_id))
+    
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, "idempotency.db")
+        db = Database(db_path)
+        db.get_or_create_chat(chat_id=10, chat_type="group", title="Chat")
+        db.get_or_create_user(user_id=1, first_name="A")
+        # Изменение записано вместе с ответом, но бот упал до отправки
+        db.update_breast_size(1, 3, 3, 10, pending_reply={
+            'update_id': 500, 'chat_id': 10, 'message_id': 7, 'text': 'ответ'
+        })
+        db.close()
+        
+        db = Database(db_path)
+        dedup = UpdateDeduplicator(db, capacity=3)
+        dedup.load()
+        assert dedup.is_duplicate(500), "Записанное обновление должно считаться обработанным"
+        assert not dedup.is_duplicate(501)
+        assert dedup.is_duplicate(501)
+        for update_id in (502, 503, 504):
+            dedup.is_duplicate(update_id)
+        assert not dedup.is_duplicate(500), "Кольцо должно вытеснять старые update_id"
+        
+        bot = FakeBot()
+        asyncio.run(dedup.resend_pending_replies(bot))
+        assert bot.sent == [(10, 'ответ', 7)]
+        db.close()
+        
+        db = Database(db_path)
+        assert db.get_pending_replies() == [], "Отправленный ответ должен удаляться"
+        assert db.get_user_stats(1)['breast_size'] == 3
+        db.close()
+        print("✅ Повторы отбрасываются, ответы переотправляются")
+        return True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_fake_telegram():
+    """Тестирует поддельный Bot API для нагрузочного теста"""
+    print("\n🛰️ Тестирование поддельного Bot API...")
+    
+    def call(method, **params):
+        data = urllib.parse.urlencode({
+            key: value if isinstance(value, str) else json.dumps(value) for key, value in params.items()
+        }).encode()
+        try:
+            with urllib.request.urlopen(f"{server.base_url}123:TEST/{method}", data, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+    
+    server = FakeTelegramServer(seed=1)
+    server.start()
+    try:
+        assert call("getMe")[1]["result"]["is_bot"]
+        first = server.inject_command(7, 7, "/tits")
+        server.inject_command(7, -100, "/top")
+        
+        updates = call("getUpdates", offset=0, timeout=1)[1]["result"]
+        assert [update["update_id"] for update in updates] == [first, first + 1]
+        assert updates[0]["message"]["entities"][0]["type"] == "bot_command"
+        assert updates[1]["message"]["chat"]["type"] == "supergroup"
+        # Подтвержденные обновления больше не отдаются
+        assert call("getUpdates", offset=first + 2, timeout=0)[1]["result"] == []
+        
+        # Текст из цифр не превращается в число, ответ связывается с сообщением
+        call("sendMessage", chat_id=-100, text="123", reply_parameters={"message_id": 1})
+        call("sendMessage", chat_id=7, text="ok")
+        assert server.wait_for_replies(2, timeout=1)
+        assert [(reply.chat_id, reply.text, reply.reply_to) for reply in server.replies] == [
+            (-100, "123", 1), (7, "ok", None)
+        ]
+        assert all(reply.latency is not None for reply in server.replies)
+        
+        server.flood_probability = 1.0
+        status, body = call("sendMessage", chat_id=7, text="flood")
+        assert status == 429 and body["parameters"]["retry_after"] == 1
+        assert server.flood_responses == 1 and len(server.replies) == 2
+        print("✅ getUpdates, sendMessage и 429 работают")
+        return True
+    finally:
+        server.stop()
+
+def test_shutdown_drain_timeout():
+    """Тестирует, что остановка укладывается в лимит дренажа, даже если обработчик завис"""
+    print("\n🛑 Тестирование ограничения времени остановки...")
+    
+    class FakeApplication:
+        """Повторяет Application из PTB: stop() ждет update_queue.join()"""
+        updater = None
+        
+        def __init__(self, handler):
+            self.running = True
+            self.update_queue = asyncio.Queue()
+            self.started = []
+            self._handler = handler
+            self._fetcher = asyncio.create_task(self._fetch())
+        
+        async def _fetch(self):
+            while True:
+                update = await self.update_queue.get()
+                try:
+                    if update is None:
+                        return
+                    self.started.append(update)
+                    await self._handler(update, None)
+                finally:
+                    self.update_queue.task_done()
+        
+        async def stop(self):
+            self.running = False
+            await self.update_queue.put(None)
+            await self.update_queue.join()
+            await self._fetcher
+        
+        async def shutdown(self):
+            self._fetcher.cancel()
+    
+    async def hanging_handler(update, context):
+        await asyncio.sleep(60)
+    
+    async def scenario():
+        lifecycle = Lifecycle(drain_timeout=0.2)
+        cleaned = []
+        lifecycle.register_cleanup(lambda: cleaned.append(True))
+        application = FakeApplication(lifecycle.track(hanging_handler))
+        for update_id in range(5):
+            application.update_queue.put_nowait(update_id)
+        await asyncio.sleep(0.01)
+        
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await lifecycle.shutdown(application)
+        elapsed = loop.time() - started
+        assert elapsed < 3, f"Остановка заняла {elapsed:.1f} с"
+        assert application.started == [0], "Обновления из очереди не должны обрабатываться после таймаута"
+        assert cleaned == [True]
+        return elapsed
+    
+    elapsed = asyncio.run(scenario())
+    print(f"✅ Остановка за {elapsed:.1f} с при зависшем обработчике")
+    return True
+
+def test_concurrent_rolls():
+    """Тестирует, что параллельные /tits одного пользователя выполняются по очереди"""
+    print("\n🔒 Тестирование параллельной обработки /tits...")
+    
+    class FakeMessage:
+        def __init__(self, message_id):
+            self.message_id = message_id
+            self.replies = []
+        
+        async def reply_text(self, text):
+            self.replies.append(text)
+    
+    class FakeUpdate:
+        def __init__(self, update_id, user, chat):
+            self.update_id = update_id
+            self.effective_user = user
+            self.effective_chat = chat
+            self.message = FakeMessage(update_id)
+    
+    class FakeUser:
+        id = 1
+        username = "a"
+        first_name = "A"
+        last_name = None
+    
+    class FakeChat:
+        id = 10
+        type = "group"
+        title = "Chat"
+    
+    workdir = tempfile.mkdtemp()
+    db = None
+    cooldown = handlers.ENFORCE_COOLDOWN
+    try:
+        db = Database(os.path.join(workdir, "concurrent.db"))
+        bot_handlers = handlers.BotHandlers(db)
+        handlers.ENFORCE_COOLDOWN = True
+        
+        async def scenario():
+            updates = [FakeUpdate(update_id, FakeUser, FakeChat) for update_id in range(1, 6)]
+            await asyncio.gather(*(bot_handlers.tits_command(update, None) for update in updates))
+            return updates
+        
+        updates = asyncio.run(scenario())
+        rolls = [update for update in updates if not update.message.replies[0].startswith("Ещё рано")]
+        assert len(rolls) == 1, "Кулдаун должен срабатывать и для одновременных /tits"
+        db.close()
+        reopened = Database(db.db_path)
+        assert reopened.get_user_stats(1)["total_changes"] == 1
+        reopened.close()
+        print("✅ Из 5 одновременных /tits выполнен один")
+        return True
+    finally:
+        handlers.ENFORCE_COOLDOWN = cooldown
+        if db:
+            db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
 if __name__ == "__main__":
     print("🚀 Запуск тестов TitsBot...")
     
     db_success = test_database()
     game_success = test_game_logic()
+    backup_success = test_backup()
+    transfer_success = test_transfer()
+    throttle_success = test_throttle()
+    migration_success = test_timestamp_migration()
+    split_success = test_read_write_split()
+    analytics_success = test_analytics()
+    chart_success = test_history_chart()
+    leaderboard_success = test_leaderboard_snapshot()
+    idempotency_success = test_idempotency()
+    fake_telegram_success = test_fake_telegram()
+    shutdown_success = test_shutdown_drain_timeout()
+    concurrency_success = test_concurrent_rolls()
     
-    if db_success and game_success:
+    if all((db_success, game_success, backup_success, transfer_success, throttle_success,
+            migration_success, split_success, analytics_success, chart_success, leaderboard_success,
+            idempotency_success, fake_telegram_success, shutdown_success, concurrency_success)):
         print("\n✅ Все тесты прошли успешно!")
         sys.exit(0)
     else:
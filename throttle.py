@@ -0,0 +1,106 @@
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional, Tuple
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from config import (
+    THROTTLE_USER_LIMIT, THROTTLE_USER_WINDOW,
+    THROTTLE_CHAT_LIMIT, THROTTLE_CHAT_WINDOW, THROTTLE_DUPLICATE_WINDOW
+)
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в вызовах) чистить ключи, по которым давно не было запросов
+_SWEEP_EVERY = 1000
+
+
+class SlidingWindowLimiter:
+    """Скользящее окно: не больше limit событий за window секунд на ключ"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits: Dict[Hashable, Deque[float]] = {}
+        self._calls = 0
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Учитывает событие и возвращает True, если лимит не превышен"""
+        if now is None:
+            now = time.monotonic()
+        self._calls += 1
+        if self._calls % _SWEEP_EVERY == 0:
+            self.sweep(now)
+
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = deque()
+        cutoff = now - self.window
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+        if len(hits) >= self.limit:
+            return False
+        hits.append(now)
+        return True
+
+    def sweep(self, now: Optional[float] = None):
+        """Удаляет ключи без событий в текущем окне, чтобы словарь не рос бесконечно"""
+        if now is None:
+            now = time.monotonic()
+        cutoff = now - self.window
+        stale = [key for key, hits in self._hits.items() if not hits or hits[-1] <= cutoff]
+        for key in stale:
+            del self._hits[key]
+
+
+class CommandThrottle:
+    """
+    Анти-спам для всех команд. Регистрируется как TypeHandler в группе -1,
+    поэтому лишние команды отбрасываются до BotHandlers и до запросов к базе.
+    """
+
+    def __init__(self, user_limit: int = THROTTLE_USER_LIMIT, user_window: float = THROTTLE_USER_WINDOW,
+                 chat_limit: int = THROTTLE_CHAT_LIMIT, chat_window: float = THROTTLE_CHAT_WINDOW,
+                 duplicate_window: float = THROTTLE_DUPLICATE_WINDOW):
+        self.users = SlidingWindowLimiter(user_limit, user_window)
+        self.chats = SlidingWindowLimiter(chat_limit, chat_window)
+        self.duplicate_window = duplicate_window
+        self._last_seen: Dict[Tuple[int, int, str], float] = {}
+
+    def _is_duplicate(self, key: Tuple[int, int, str], now: float) -> bool:
+        """Та же команда от того же пользователя в том же чате только что уже была"""
+        last = self._last_seen.get(key)
+        self._last_seen[key] = now
+        if len(self._last_seen) > _SWEEP_EVERY * 10:
+            cutoff = now - self.duplicate_window
+            self._last_seen = {k: t for k, t in self._last_seen.items() if t > cutoff}
+        return last is not None and now - last < self.duplicate_window
+
+    def allow(self, user_id: int, chat_id: int, text: str, now: Optional[float] = None) -> bool:
+        """Решает, пропускать ли команду"""
+        if now is None:
+            now = time.monotonic()
+        # Повторы не расходуют лимит, их просто схлопываем
+        if self._is_duplicate((user_id, chat_id, text), now):
+            return False
+        if not self.users.allow(user_id, now):
+            return False
+        return self.chats.allow(chat_id, now)
+
+    async def gate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пропускает команду дальше или молча отбрасывает ее"""
+        # effective_message: CommandHandler принимает и отредактированные сообщения
+        message = update.effective_message
+        if not message or not message.text or not message.text.startswith('/'):
+            return
+        user = update.effective_user
+        chat = update.effective_chat
+        if not user or not chat:
+            return
+        # '/top@titsbot' и '/top' — одна и та же команда
+        parts = message.text.split()
+        command = parts[0].split('@')[0].lower()
+        if not self.allow(user.id, chat.id, ' '.join([command] + parts[1:])):
+            logger.debug(f"Команда {command} от {user.id} в чате {chat.id} отброшена анти-спамом")
+            raise ApplicationHandlerStop
+
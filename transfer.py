@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Потоковый экспорт/импорт данных TitsBot между экземплярами.
+
+Каждая таблица пишется в отдельный файл (<таблица>.ndjson или <таблица>.csv,
+опционально .gz). Чтение идет курсором порциями по fetchmany, запись —
+executemany порциями в отдельных транзакциях, поэтому память не зависит
+от размера базы. Импорт выполняется только в пустую базу: id записей
+истории в разных экземплярах пересекаются, и слияние испортило бы данные.
+
+Примеры:
+    python transfer.py export dump/ --format ndjson --gzip
+    python transfer.py import dump/ --db new_titsbot.db
+"""
+
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import logging
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+from config import DATABASE_PATH
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен для импорта: сначала таблицы, на которые ссылается size_history
+TABLES = ('chats', 'users', 'size_history')
+FORMATS = ('ndjson', 'csv')
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    """Возвращает список колонок таблицы"""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _file_name(table: str, fmt: str, compress: bool) -> str:
+    return f"{table}.{fmt}" + ('.gz' if compress else '')
+
+
+def _open_text(path: str, mode: str) -> TextIO:
+    """Открывает файл в текстовом режиме, .gz — через gzip"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def export_table(conn: sqlite3.Connection, table: str, out_path: str,
+                 fmt: str = 'ndjson', chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Выгружает таблицу в файл, возвращает количество строк"""
+    columns = _table_columns(conn, table)
+    cursor = conn.cursor()
+    cursor.arraysize = chunk_size
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+
+    total = 0
+    with _open_text(out_path, 'w') as f:
+        writer = None
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                    for row in rows
+                )
+            total += len(rows)
+    return total
+
+
+def _read_ndjson(f: TextIO) -> Iterator[Dict]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _read_csv(f: TextIO) -> Iterator[Dict]:
+    for row in csv.DictReader(f):
+        # В CSV нет NULL: пустая строка означает отсутствие значения
+        yield {key: (value if value != '' else None) for key, value in row.items()}
+
+
+def _chunks(records: Iterable[Dict], columns: List[str], chunk_size: int) -> Iterator[List[tuple]]:
+    chunk = []
+    for record in records:
+        chunk.append(tuple(record.get(column) for column in columns))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_table(conn: sqlite3.Connection, table: str, in_path: str,
+                 fmt: str = 'ndjson', chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Загружает таблицу из файла, возвращает количество строк"""
+    table_columns = _table_columns(conn, table)
+    with _open_text(in_path, 'r') as f:
+        records = _read_csv(f) if fmt == 'csv' else _read_ndjson(f)
+
+        # Колонки берем из первой записи, лишние (от других версий схемы) отбрасываем
+        first = next(records, None)
+        if first is None:
+            return 0
+        columns = [column for column in first if column in table_columns]
+        placeholders = ', '.join('?' for _ in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+        def all_records():
+            yield first
+            yield from records
+
+        total = 0
+        for chunk in _chunks(all_records(), columns, chunk_size):
+            with conn:
+                conn.executemany(sql, chunk)
+            total += len(chunk)
+    return total
+
+
+def export_all(db_path: str, out_dir: str, fmt: str = 'ndjson', compress: bool = False,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, int]:
+    """Выгружает все таблицы в каталог"""
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        # Одна читающая транзакция — все таблицы выгружаются из согласованного состояния
+        conn.execute('BEGIN')
+        for table in TABLES:
+            started = time.monotonic()
+            path = os.path.join(out_dir, _file_name(table, fmt, compress))
+            counts[table] = export_table(conn, table, path, fmt, chunk_size)
+            logger.info(f"{table}: выгружено {counts[table]} строк за {time.monotonic() - started:.1f} с")
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return counts
+
+
+class TargetNotEmpty(Exception):
+    """В базе, куда выполняется импорт, уже есть данные"""
+
+
+def _non_empty_tables(conn: sqlite3.Connection) -> List[str]:
+    return [table for table in TABLES if conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone()]
+
+
+def import_all(db_path: str, in_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, int]:
+    """
+    Загружает все найденные в каталоге таблицы (формат определяется по имени файла).
+    База должна быть пустой, иначе выбрасывается TargetNotEmpty
+    """
+    db = Database(db_path)  # создаем схему, если база новая
+    counts = {}
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            non_empty = _non_empty_tables(conn)
+            if non_empty:
+                raise TargetNotEmpty(
+                    f"В базе {db_path} уже есть данные ({', '.join(non_empty)}); "
+                    f"импорт возможен только в пустую базу"
+                )
+            # Порции и так фиксируются по одной; ждать fsync на каждую незачем
+            conn.execute('PRAGMA synchronous = NORMAL')
+            for table in TABLES:
+                path = _find_table_file(in_dir, table)
+                if not path:
+                    logger.warning(f"{table}: файл не найден в {in_dir}, пропускаем")
+                    continue
+                fmt = 'csv' if '.csv' in os.path.basename(path) else 'ndjson'
+                started = time.monotonic()
+                counts[table] = import_table(conn, table, path, fmt, chunk_size)
+                logger.info(f"{table}: загружено {counts[table]} строк за {time.monotonic() - started:.1f} с")
+        finally:
+            conn.close()
+        # Дампы старых версий содержат время текстом
+        db.convert_text_timestamps()
+        # Агрегаты для /globalstats не переносятся, а пересчитываются
+        db.rebuild_analytics()
+    finally:
+        db.close()
+    return counts
+
+
+def _find_table_file(in_dir: str, table: str) -> Optional[str]:
+    for fmt in FORMATS:
+        for compress in (True, False):
+            path = os.path.join(in_dir, _file_name(table, fmt, compress))
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Экспорт/импорт данных TitsBot")
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('directory', help="каталог с файлами таблиц")
+    parser.add_argument('--db', default=DATABASE_PATH, help="путь к базе (по умолчанию DATABASE_PATH)")
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help="формат экспорта")
+    parser.add_argument('--gzip', action='store_true', help="сжимать файлы экспорта")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    if args.action == 'export':
+        counts = export_all(args.db, args.directory, args.format, args.gzip, args.chunk_size)
+    else:
+        try:
+            counts = import_all(args.db, args.directory, args.chunk_size)
+        except TargetNotEmpty as e:
+            logger.error(str(e))
+            return 1
+    print(json.dumps(counts, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())